@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+'''
+异步分析服务
+
+GoVideoAnalyzer 是阻塞的，分析任务在线程池中运行，每分析出一个回合就通知所有订阅者。
+同时运行的分析数量有上限，任务可以取消。
+
+服务通过本机 TCP 端口提供，每行一个 json 请求或回复：
+    {"cmd": "submit", "video": 视频路径, "frame_step": 步长}  ->  {"job": 任务号}
+    {"cmd": "subscribe", "job": 任务号}                       ->  已有及之后的事件，每行一个，任务结束后停止
+    {"cmd": "cancel", "job": 任务号}                          ->  {"ok": 是否成功}
+    {"cmd": "jobs"}                                           ->  {"jobs": {任务号: 状态}}
+
+事件：
+    {"type": "round", "round_no": 回合, "who": 下棋方, "action": 动作, "down": [x, y, 序号], "take": [...], "frame": 帧数}
+    {"type": "finished", "sgf": 棋谱文本}
+    {"type": "cancelled"}
+    {"type": "error", "error": 错误信息}
+
+用法: python analysis_service.py [端口] [最大同时分析数]
+'''
+
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import threading
+
+
+'任务状态'
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_CANCELLED = 'cancelled'
+JOB_ERROR = 'error'
+
+
+class Cancelled(Exception):
+    '分析任务被取消'
+    pass
+
+
+
+def round_event(rd):
+    '将回合转为事件 dict'
+    return {'type': 'round', 'round_no': rd.round_no, 'who': rd.who, 'action': rd.action, 'down': rd.down, \
+            'take': rd.take, 'frame': rd.frame_no}
+
+
+def analyze(video_path, frame_step, publish, cancel_event):
+    '''分析一个视频（在线程池中运行），每个回合调用 publish(事件)
+
+    cancel_event: threading.Event，被设置时在分析下一帧前停止分析
+
+    返回 结束事件
+    '''
+    from go_video_analyzer import GoVideoAnalyzer
+
+    analyzer = GoVideoAnalyzer()
+    if analyzer.load_video(video_path, frame_step)[0] == False:
+        analyzer.cap.release()
+        raise IOError('读取视频失败: {}'.format(video_path))
+    if analyzer.analyze_cross_point()[0] == False:
+        analyzer.cap.release()
+        raise ValueError('分析棋盘交点失败: {}'.format(video_path))
+
+    try:
+        while True:
+            # 每帧检查取消标志，取消后不再继续解码视频
+            rets = analyzer.next_round(cancel_event.is_set)
+            if cancel_event.is_set():
+                raise Cancelled()
+            if rets[0] == False:
+                break
+            for rd in rets[2:]:
+                if rd is not None:
+                    publish(round_event(rd))
+    finally:
+        analyzer.cap.release()
+    return {'type': JOB_FINISHED, 'sgf': analyzer.go_process.get_sgf_text()}
+
+
+
+class AnalysisJob(object):
+    '分析任务，记录已发生的事件并转发给订阅者'
+
+    def __init__(self, job_id, video_path, frame_step=None):
+        self.job_id = job_id
+        self.video_path = video_path
+        self.frame_step = frame_step
+        self.status = JOB_PENDING
+        self.events = []  # 已发生的事件
+        self.task = None  # asyncio 任务
+        self._subscribers = set()  # 订阅者的事件队列
+        self._cancel_event = threading.Event()
+
+
+    @property
+    def done(self):
+        return self.status in (JOB_FINISHED, JOB_CANCELLED, JOB_ERROR)
+
+
+    def publish(self, event):
+        '记录事件并发送给所有订阅者（在事件循环中调用）'
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+
+    def finish(self, event):
+        '以结束事件结束任务（在事件循环中调用）'
+        self.status = event['type']
+        self.publish(event)
+
+
+    async def subscribe(self):
+        '异步生成已有及之后的事件，任务结束后停止'
+        queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if not self.done:
+            self._subscribers.add(queue)
+        try:
+            while True:
+                if queue.empty() and self.done:
+                    return
+                event = await queue.get()
+                yield event
+                if event['type'] in (JOB_FINISHED, JOB_CANCELLED, JOB_ERROR):
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+
+    def cancel(self):
+        '取消任务，返回是否成功'
+        if self.done:
+            return False
+        self._cancel_event.set()
+        if self.status == JOB_PENDING and self.task is not None:
+            # 还在等待运行，直接取消
+            self.task.cancel()
+            self.finish({'type': JOB_CANCELLED})
+        return True
+
+
+
+class AnalysisService(object):
+    '异步分析服务类'
+
+    def __init__(self, max_concurrent=None, executor=None):
+        '''
+        max_concurrent: 最大同时分析数，None 表示 CPU 核数
+
+        executor: 运行分析的线程池（concurrent.futures.ThreadPoolExecutor），None 表示创建 max_concurrent 个线程的线程池。
+        回合通知和取消标志在线程间共享，不能使用进程池
+        '''
+        if executor is not None and not isinstance(executor, concurrent.futures.ThreadPoolExecutor):
+            raise TypeError('executor 必须是 ThreadPoolExecutor: {!r}'.format(executor))
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(self.max_concurrent)
+        self.jobs = {}  # {任务号: AnalysisJob}
+        self._semaphore = None  # 需在事件循环中创建
+        self._job_ids = itertools.count(1)
+
+
+    def submit(self, video_path, frame_step=None):
+        '提交分析任务（需在事件循环中调用），返回 AnalysisJob'
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        job = AnalysisJob(next(self._job_ids), video_path, frame_step)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+
+    def subscribe(self, job_id):
+        '订阅任务事件，返回异步生成器'
+        return self.jobs[job_id].subscribe()
+
+
+    def cancel(self, job_id):
+        '取消任务，返回是否成功'
+        job = self.jobs.get(job_id)
+        return job is not None and job.cancel()
+
+
+    async def _run(self, job):
+        '等待空闲名额后在线程池中运行分析'
+        loop = asyncio.get_running_loop()
+        publish = lambda event: loop.call_soon_threadsafe(job.publish, event)
+        try:
+            async with self._semaphore:
+                job.status = JOB_RUNNING
+                event = await loop.run_in_executor(self.executor, analyze, job.video_path, job.frame_step, \
+                                                   publish, job._cancel_event)
+        except asyncio.CancelledError:
+            if not job.done:
+                job.finish({'type': JOB_CANCELLED})
+            raise
+        except Cancelled:
+            event = {'type': JOB_CANCELLED}
+        except Exception as e:
+            event = {'type': JOB_ERROR, 'error': repr(e)}
+        # 回合事件由 call_soon_threadsafe 按顺序排队，此时都已发送
+        job.finish(event)
+
+
+    async def _handle_client(self, reader, writer):
+        '处理一个 TCP 客户端的请求'
+        async def send(message):
+            writer.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    cmd = request['cmd']
+                    if cmd == 'submit':
+                        job = self.submit(request['video'], request.get('frame_step'))
+                        await send({'job': job.job_id})
+                    elif cmd == 'subscribe':
+                        async for event in self.subscribe(request['job']):
+                            await send(event)
+                    elif cmd == 'cancel':
+                        await send({'ok': self.cancel(request['job'])})
+                    elif cmd == 'jobs':
+                        await send({'jobs': {job_id: job.status for job_id, job in self.jobs.items()}})
+                    else:
+                        await send({'error': '未知命令: {}'.format(cmd)})
+                except (ValueError, KeyError) as e:
+                    await send({'error': repr(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def serve(self, host='127.0.0.1', port=0):
+        '''在本机启动 TCP 服务
+
+        port: 端口，0 表示自动选择
+
+        返回 asyncio.Server，端口可由 server.sockets[0].getsockname()[1] 获得
+        '''
+        return await asyncio.start_server(self._handle_client, host, port)
+
+
+
+if __name__ == '__main__':
+    import sys
+
+    async def main():
+        service = AnalysisService(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        server = await service.serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+        print('serving on {}:{}'.format(*server.sockets[0].getsockname()[:2]))
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+'''
+批量分析任务
+
+以 视频内容摘要 + 分析参数 为键缓存分析结果，只分析缓存中没有的视频。
+缓存目录按总大小限制，超出时删除最久未使用的结果。
+分析中定期在缓存目录保存检查点，任务中断后重新运行时从检查点继续分析。
+'''
+
+import hashlib
+import json
+import os
+
+from lazy_import import lazy_import
+
+multiprocessing = lazy_import('multiprocessing')
+
+'结果格式版本，分析结果的含义变化时修改，使旧缓存失效'
+RESULT_VERSION = 1
+
+
+def video_hash(path, chunks=16, chunk_size=1 << 16):
+    '''计算视频文件的内容摘要
+
+    只读取文件大小和均匀分布的若干块数据，大文件也能很快计算
+    '''
+    size = os.path.getsize(path)
+    sha1 = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= chunks * chunk_size:
+            sha1.update(f.read())
+        else:
+            for i in range(chunks):
+                f.seek((size - chunk_size) * i // (chunks - 1))
+                sha1.update(f.read(chunk_size))
+    return sha1.hexdigest()
+
+
+def _to_json(value):
+    'numpy 数组等转为可以 json 序列化的值'
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(repr(value))
+
+
+def job_key(path, params):
+    '任务缓存键：视频内容摘要 + 分析参数'
+    text = json.dumps([RESULT_VERSION, video_hash(path), params], sort_keys=True, default=_to_json)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def default_params():
+    '默认分析参数，与 GoVideoAnalyzer 的默认值一致'
+    from go_video_analyzer import GoVideoAnalyzer
+    analyzer = GoVideoAnalyzer()
+    return {
+        'frame_step': None,  # None 表示按视频帧率
+        'black_hsv': analyzer._black_hsv.tolist(),
+        'white_hsv': analyzer._white_hsv.tolist(),
+        'qizi_color_threshold': analyzer.qizi_color_threshold,
+        'confidence_threshold': analyzer.confidence_threshold,
+        'resample_count': analyzer.resample_count,
+        'coarse_factor': analyzer.coarse_factor,
+        'calibrate': False,  # 是否自动校准棋子颜色
+        'cross_point_kw': json.loads(json.dumps(analyzer.cross_point_kw, default=_to_json)),
+    }
+
+
+def analyze_video(path, params, checkpoint_path=None):
+    '''按参数分析一个视频，返回结果 dict
+
+    checkpoint_path: 检查点文件路径，分析中定期保存，文件存在时从检查点继续分析，分析完成后删除
+
+    结果包含 sgf 棋谱文本和每个回合的 (帧数, 下棋方, 动作, 落子坐标, 提子坐标)
+    '''
+    import numpy as np
+    from go_video_analyzer import GoVideoAnalyzer
+
+    analyzer = GoVideoAnalyzer()
+    analyzer._black_hsv = np.array(params['black_hsv'])
+    analyzer._white_hsv = np.array(params['white_hsv'])
+    analyzer.qizi_color_threshold = params['qizi_color_threshold']
+    analyzer.confidence_threshold = params['confidence_threshold']
+    analyzer.resample_count = params['resample_count']
+    analyzer.coarse_factor = params['coarse_factor']
+    analyzer.cross_point_kw = dict(params['cross_point_kw'])
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        if analyzer.load_checkpoint(checkpoint_path, path)[0] == False:
+            return {'video': path, 'error': '读取视频失败'}
+    else:
+        if analyzer.load_video(path, params['frame_step'])[0] == False:
+            return {'video': path, 'error': '读取视频失败'}
+        if analyzer.analyze_cross_point()[0] == False:
+            return {'video': path, 'error': '分析棋盘交点失败'}
+        if params['calibrate']:
+            analyzer.calibrate_colors()
+
+    # 逐回合分析，定期保存检查点，中断后可继续
+    analyzer.checkpoint_path = checkpoint_path
+    while analyzer.next_round()[0]:
+        pass
+    analyzer.cap.release()
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    go_process = analyzer.go_process
+    rounds = [(rd.frame_no, rd.who, rd.action, rd.down, rd.take) for rd in go_process.process]
+    return {'video': path, 'board_size': go_process.shape[0], 'sgf': go_process.get_sgf_text(), 'rounds': rounds}
+
+
+def _run_job(job):
+    '进程池中运行的任务'
+    key, path, params, checkpoint_path = job
+    try:
+        return key, analyze_video(path, params, checkpoint_path)
+    except Exception as e:
+        return key, {'video': path, 'error': repr(e)}
+
+
+
+class ResultCache(object):
+    '分析结果缓存，按总大小限制，超出时删除最久未使用的结果'
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+
+    def checkpoint_path(self, key):
+        '分析中的检查点文件路径，不计入缓存大小'
+        return os.path.join(self.cache_dir, key + '.checkpoint')
+
+
+    def get(self, key):
+        '读取缓存结果，不存在时返回 None'
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # 更新使用时间
+        return result
+
+
+    def put(self, key, result):
+        '保存结果，并删除超出大小限制的旧结果'
+        path = self._path(key)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, default=_to_json)
+        os.replace(temp_path, path)
+        self.evict()
+
+
+    def evict(self):
+        '按使用时间从旧到新删除结果，直到总大小不超过限制'
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+
+
+class BatchRunner(object):
+    '批量分析任务类'
+
+    def __init__(self, cache_dir, processes=None, max_cache_bytes=1 << 30, **params):
+        '''
+        cache_dir: 结果缓存目录
+
+        processes: 进程数，None 表示 CPU 核数
+
+        max_cache_bytes: 缓存目录大小上限
+
+        params: 分析参数，覆盖 default_params() 中的同名参数
+        '''
+        self.cache = ResultCache(cache_dir, max_cache_bytes)
+        self.processes = processes
+        self.params = default_params()
+        self.params.update(params)
+
+
+    def run(self, video_paths, callback=None):
+        '''分析多个视频，已缓存的直接读取
+
+        callback: 每完成一个视频调用 callback(视频路径, 结果, 是否来自缓存)
+
+        返回 {视频路径: 结果}
+        '''
+        results = {}
+        jobs = {}  # 缓存键: 内容相同的视频路径列表，相同的视频只分析一次
+        for path in video_paths:
+            try:
+                key = job_key(path, self.params)
+            except OSError as e:
+                self._done(results, path, {'video': path, 'error': repr(e)}, False, callback)
+                continue
+            result = self.cache.get(key)
+            if result is None:
+                jobs.setdefault(key, []).append(path)
+            else:
+                self._done(results, path, result, True, callback)
+
+        if jobs:
+            tasks = [(key, paths[0], self.params, self.cache.checkpoint_path(key)) for key, paths in jobs.items()]
+            with multiprocessing.Pool(self.processes) as pool:
+                for key, result in pool.imap_unordered(_run_job, tasks):
+                    if 'error' not in result:
+                        self.cache.put(key, result)
+                    for path in jobs[key]:
+                        self._done(results, path, result, False, callback)
+        return results
+
+
+    @staticmethod
+    def _done(results, path, result, cached, callback):
+        '记录一个视频的结果'
+        result = dict(result, video=path)
+        results[path] = result
+        if callback is not None:
+            callback(path, result, cached)
+
+
+if __name__ == '__main__':
+    import sys
+
+    runner = BatchRunner(os.path.join(os.path.expanduser('~'), '.go_analyzer_cache'))
+    runner.run(sys.argv[1:], lambda path, result, cached: \
+        print('{} {} {}'.format(path, '缓存' if cached else '分析', result.get('error', len(result['rounds'])))))
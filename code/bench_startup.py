@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+'''
+启动时间基准测试
+
+在新的 Python 进程中分别导入各模块，测量导入耗时，并检查不需要 cv2、Qt 的模块没有导入它们。
+超出时间预算或导入了不应导入的模块时，返回非零退出码。
+
+用法: python bench_startup.py [重复次数]
+'''
+
+import os
+import subprocess
+import sys
+
+
+'模块名: (导入耗时预算（毫秒）, 不应导入的模块)'
+BUDGETS = {
+    'go_process': (30, ('numpy', 'cv2', 'PyQt5')),
+    'timeline': (200, ('cv2', 'PyQt5')),
+    'game_archive': (200, ('cv2', 'PyQt5')),
+    'go_video_analyzer': (250, ('cv2', 'PyQt5')),
+    'analysis_service': (150, ('numpy', 'cv2', 'PyQt5')),
+}
+
+_CODE = '''
+import sys, time
+t = time.perf_counter()
+import {0}
+t = time.perf_counter() - t
+print(t * 1000, *[name for name in {1!r} if name in sys.modules])
+'''
+
+
+def measure(module, forbidden):
+    '在新进程中导入模块，返回 (耗时毫秒, 已导入的不应导入模块列表)'
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.check_output([sys.executable, '-c', _CODE.format(module, forbidden)], cwd=cwd)
+    fields = out.decode().split()
+    return float(fields[0]), fields[1:]
+
+
+def main(repeat=5):
+    ok = True
+    for module, (budget, forbidden) in BUDGETS.items():
+        results = [measure(module, forbidden) for _ in range(repeat)]
+        best = min(t for t, loaded in results)
+        loaded = results[0][1]
+        passed = best <= budget and not loaded
+        ok = ok and passed
+        print('{:<20} {:8.1f} ms  (预算 {} ms) {}{}'.format(module, best, budget, \
+            '通过' if passed else '失败', '  导入了 ' + ', '.join(loaded) if loaded else ''))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
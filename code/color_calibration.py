@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+'''
+棋子颜色自动校准
+
+将开局若干帧交叉点的 hsv 颜色聚类为空白、黑棋、白棋三类，得到棋子参考颜色和颜色阈值
+'''
+
+import json
+
+import numpy as np
+
+
+def _kmeans(samples, centers, iterations=20):
+    '以给定初始中心进行 k-means 聚类，返回 (聚类中心, 样本所属类别)'
+    for _ in range(iterations):
+        # 使用切比雪夫距离，与分类器的阈值判断方式一致
+        dist = np.abs(samples[:, None, :] - centers[None, :, :]).max(axis=2)
+        labels = dist.argmin(axis=1)
+        new_centers = centers.copy()
+        for i in range(len(centers)):
+            if (labels == i).any():
+                new_centers[i] = np.median(samples[labels == i], axis=0)
+        if (new_centers == centers).all():
+            break
+        centers = new_centers
+    return centers, labels
+
+
+def calibrate_colors(hsv_samples, black_hsv, white_hsv, threshold, min_contrast=40):
+    '''聚类交叉点颜色，校准棋子颜色
+
+    hsv_samples: 开局若干帧交叉点的 hsv 颜色，最后一维为 h s v
+
+    black_hsv, white_hsv, threshold: 当前的黑棋、白棋颜色和颜色阈值，未找到对应棋子时保留
+
+    min_contrast: 棋子颜色与棋盘颜色的最小差值，小于该值认为没有找到该类棋子
+
+    返回 dict，包含 empty_hsv, black_hsv, white_hsv, threshold
+    '''
+    samples = np.asarray(hsv_samples, dtype=float).reshape(-1, 3)
+
+    # 初始中心：最暗的样本、中值（开局棋盘大部分为空白）、离前两者最远的样本
+    dark = samples[samples[:, 2].argmin()]
+    empty = np.median(samples, axis=0)
+    far = np.minimum(np.abs(samples - dark).max(axis=1), np.abs(samples - empty).max(axis=1))
+    centers, labels = _kmeans(samples, np.array([dark, empty, samples[far.argmax()]]))
+
+    # 数量最多的一类为空白棋盘
+    counts = np.bincount(labels, minlength=3)
+    i_empty = counts.argmax()
+    empty_hsv = centers[i_empty]
+    others = [i for i in range(3) if i != i_empty and counts[i] > 0]
+    others.sort(key=lambda i: centers[i][2])
+
+    black_hsv = np.asarray(black_hsv, dtype=float)
+    white_hsv = np.asarray(white_hsv, dtype=float)
+    # 最暗的一类明显比棋盘暗，认为是黑棋
+    if others and empty_hsv[2] - centers[others[0]][2] >= min_contrast:
+        black_hsv = centers[others.pop(0)]
+    # 剩余一类与棋盘颜色差别明显，认为是白棋
+    if others and np.abs(centers[others[-1]] - empty_hsv).max() >= min_contrast:
+        white_hsv = centers[others[-1]]
+
+    # 阈值取棋盘颜色到最近的棋子颜色距离的一半
+    black_dist = abs(empty_hsv[2] - black_hsv[2])
+    white_dist = np.abs(white_hsv - empty_hsv).max()
+    if min(black_dist, white_dist) >= min_contrast:
+        threshold = float(min(black_dist, white_dist)) / 2
+
+    return {'empty_hsv': empty_hsv, 'black_hsv': black_hsv, 'white_hsv': white_hsv, 'threshold': threshold}
+
+
+def save_calibration(path, calibration):
+    '保存颜色校准结果（如按摄像头保存），json 格式'
+    data = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in calibration.items()}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_calibration(path):
+    '读取颜色校准结果'
+    with open(path) as f:
+        data = json.load(f)
+    return {k: (np.array(v) if isinstance(v, list) else v) for k, v in data.items()}
@@ -8,31 +8,96 @@ author: Sunny An
 date: 2017年4月18日 星期二
 '''
 
-import cv2
 import numpy as np
 import math
 
+from lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
 
 # 形态学运算的模板
 __kernel = np.ones((3,3), np.uint8)
 
-def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_threshold=300, r_error=10, t_error=10*np.pi/180):
+# 只取 ± theta_range 误差内的的水平或垂直直线
+__theta_range = 20 * np.pi / 180  # 20°
+
+def _segment_lines(close, line_threshold, r_error, t_error):
     '''
-    获取灰度图像中水平直线、垂直直线的交点坐标
+    用概率 Hough 变换检测线段，只保留接近水平、垂直的线段，并将共线的线段合并为直线
 
-    gray_img: 灰度图像
+    合并后线段总长度不小于 line_threshold 的直线才被保留
 
-    canny_thresholds: Canny 算法获取图像边界的两个阈值
+    返回 (水平直线列表, 垂直直线列表)，直线以 (rho, theta) 表示，按 |rho| 升序排列
+    '''
+    min_length = max(line_threshold // 20, 10)  # 最短线段长度
+    segments = cv2.HoughLinesP(close, 1, np.pi / 180, min_length, minLineLength=min_length, maxLineGap=3)
+    if segments is None:
+        return [], []
 
-    close_times: 形态学闭运算次数
+    height, width = close.shape[:2]
+    xc, yc = width / 2, height / 2  # 图像中心
 
-    line_threshold: Hough 变换检测直线的投票阈值
+    # 各线段的 (位置, 角度, 长度)，水平线位置为直线在图像中心处的 y 值，垂直线为 x 值
+    # 角度为法线与 y 轴（水平线）或 x 轴（垂直线）的夹角
+    horizontal_segments = []
+    vertical_segments = []
+    for x1, y1, x2, y2 in segments.reshape(-1, 4):
+        dx, dy = float(x2 - x1), float(y2 - y1)
+        length = math.hypot(dx, dy)
+        angle = math.atan2(dy, dx)
+        if abs(math.sin(angle)) <= math.sin(__theta_range):
+            # 接近水平，angle 折算到 ±theta_range 内
+            angle = math.atan(dy / dx)
+            position = y1 + (xc - x1) * math.tan(angle)
+            horizontal_segments.append((position, angle, length))
+        elif abs(math.cos(angle)) <= math.sin(__theta_range):
+            # 接近垂直，angle 为偏离垂直方向的角度，顺时针为正
+            angle = math.atan(dx / dy)
+            position = x1 + (yc - y1) * math.tan(angle)
+            vertical_segments.append((position, angle, length))
 
-    r_error: Hough 变换检测直线时，r 值之差小于 r_error 认为是相似直线
+    def merge(segment_list):
+        '按位置排序，位置相差不超过 r_error 且角度相差不超过 t_error 的线段合并为一条直线'
+        lines = []
+        group = []
+        for segment in sorted(segment_list) + [None]:
+            if group and (segment is None or segment[0] - group[-1][0] > r_error \
+            or abs(segment[1] - group[0][1]) > t_error):
+                total = sum(length for position, angle, length in group)
+                if total >= line_threshold:
+                    position = sum(p * l for p, a, l in group) / total
+                    angle = sum(a * l for p, a, l in group) / total
+                    lines.append((position, angle))
+                group = []
+            if segment is not None:
+                group.append(segment)
+        return lines
 
-    t_error: Hough 变换检测直线时，theta 值之差小于 t_error 认为是相似直线
+    horizontal_lines = []  # 水平线
+    for y, angle in merge(horizontal_segments):
+        # 法线角度 theta = 90° + angle，直线过点 (xc, y)
+        theta = np.pi / 2 + angle
+        horizontal_lines.append((xc * math.cos(theta) + y * math.sin(theta), theta))
+    vertical_lines = []  # 垂直线
+    for x, angle in merge(vertical_segments):
+        # 法线角度 theta = -angle，折算到 [0, pi)
+        theta = -angle
+        rho = x * math.cos(theta) + yc * math.sin(theta)
+        if theta < 0:
+            theta, rho = theta + np.pi, -rho
+        vertical_lines.append((rho, theta))
+
+    horizontal_lines.sort(key=lambda line: abs(line[0]))
+    vertical_lines.sort(key=lambda line: abs(line[0]))
+    return horizontal_lines, vertical_lines
+
+
+def _detect_lines(gray_img, canny_thresholds, close_times, line_threshold, r_error, t_error, method='hough'):
+    '''
+    检测灰度图像中的水平直线、垂直直线
 
-    返回 二值图像，numpy 三维数组，前两维表示交点的顺序，最后一维长度为 2 ，表示交点 x, y 坐标
+    返回 (二值图像, 水平直线列表, 垂直直线列表)，直线以 (rho, theta) 表示，按 |rho| 升序排列
     '''
 
     # Canny 算法求边界
@@ -41,13 +106,18 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
     # 形态学运算，闭运算(先膨胀，后腐蚀)，填充空隙
     close = cv2.morphologyEx(canny, cv2.MORPH_CLOSE, __kernel, anchor=(1,1), iterations=close_times)
 
+    if method == 'segment':
+        # 概率 Hough 变换检测线段，合并为直线
+        return (close,) + _segment_lines(close, line_threshold, r_error, t_error)
+    elif method != 'hough':
+        raise ValueError('未知的直线检测方法: {}'.format(method))
+
     # Hough 变换，检测直线
     lines = cv2.HoughLines(close, 1, np.pi / 180, line_threshold)
     if lines is None:
-        return close, None
+        return close, [], []
     
-    # 只取 ± theta_range 误差内的的水平或垂直直线
-    theta_range = 20 * np.pi / 180  # 20°
+    theta_range = __theta_range
 
     # 最终筛选之后的直线
     horizontal_lines = []  # 水平线
@@ -92,14 +162,18 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
         if not found_similar:
             line_list.insert(insert_position, (rho, theta))
 
-    
-    len_h_lines, len_v_lines = len(horizontal_lines), len(vertical_lines)
-    if len_h_lines < 3 or len_v_lines < 3:
-        # 直线数量不足，认为没找到
-        return close, None
-    
+    return close, horizontal_lines, vertical_lines
+
+
+def _intersect_lines(horizontal_lines, vertical_lines):
+    '''
+    求水平直线与垂直直线的所有交点
+
+    返回 numpy 三维数组，前两维表示交点的顺序，最后一维长度为 2 ，表示交点 x, y 坐标
+    '''
     # 求得所有交点
     # 创建存放交点的数组
+    len_h_lines, len_v_lines = len(horizontal_lines), len(vertical_lines)
     points = np.empty((len_h_lines, len_v_lines, 2), dtype=int)
     for i in range(len_h_lines):
         c1, s1, r1 = math.cos(horizontal_lines[i][1]), math.sin(horizontal_lines[i][1]), horizontal_lines[i][0]
@@ -110,7 +184,22 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
             y = int(round((r1 * c2 - r2 * c1) / denominator))
             points[i, j] = x, y
 
-    # 过滤不在棋盘上的直线
+    return points
+
+
+def _in_image(img, x, y):
+    '点是否在图像内'
+    return 0 <= y < img.shape[0] and 0 <= x < img.shape[1]
+
+
+def _board_range(points, close):
+    '''
+    过滤不在棋盘上的直线
+
+    返回 棋盘范围内直线的序号 (top, bottom, left, right)
+    '''
+    len_h_lines, len_v_lines = points.shape[:2]
+
     top, bottom, left , right = 0, 0, 0, 0
     #过滤上方水平直线
     for i in range(len_h_lines - 1):
@@ -118,7 +207,7 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
         for j in range(len_v_lines):
             x = int(round(np.average(points[i: i + 2, j, 0])))
             y = int(round(np.average(points[i: i + 2, j, 1])))
-            if 255 in close[y, x - 3: x + 3]:
+            if _in_image(close, x, y) and 255 in close[y, x - 3: x + 3]:
                 count += 1
         if count > len_v_lines // 2:
             # 超过一半的点在垂直直线上，认为该直线有效
@@ -130,7 +219,7 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
         for j in range(len_v_lines):
             x = int(round(np.average(points[i: i + 2, j, 0])))
             y = int(round(np.average(points[i: i + 2, j, 1])))
-            if 255 in close[y, x - 3: x + 3]:
+            if _in_image(close, x, y) and 255 in close[y, x - 3: x + 3]:
                 count += 1
         if count > len_v_lines // 2:
             # 超过一半的点在垂直直线上，认为该直线有效
@@ -142,7 +231,7 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
         for j in range(len_h_lines):
             x = int(round(np.average(points[j, i: i + 2, 0])))
             y = int(round(np.average(points[j, i: i + 2, 1])))
-            if 255 in close[y - 3: y + 3, x]:
+            if _in_image(close, x, y) and 255 in close[y - 3: y + 3, x]:
                 count += 1
         if count > len_h_lines // 2:
             # 超过一半的点在垂直直线上，认为该直线有效
@@ -154,16 +243,299 @@ def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_
         for j in range(len_h_lines):
             x = int(round(np.average(points[j, i: i + 2, 0])))
             y = int(round(np.average(points[j, i: i + 2, 1])))
-            if 255 in close[y, x - 3: x + 3]:
+            if _in_image(close, x, y) and 255 in close[y, x - 3: x + 3]:
                 count += 1
         if count > len_h_lines // 2:
             # 超过一半的点在垂直直线上，认为该直线有效
             right = i + 1
             break
-    
-    # 精确地坐标
-    # horizontal_lines = horizontal_lines[top: bottom + 1]
-    # vertical_lines = vertical_lines[left: right + 1]
-    points = points[top: bottom + 1, left: right + 1]
-    
+
+    return top, bottom, left, right
+
+
+def _refine_line(gray_img, line, band, canny_thresholds):
+    '''
+    在全分辨率图像中直线附近的窄带内精确定位直线
+
+    line: 由缩小图像检测并换算到全分辨率的直线 (rho, theta)
+
+    band: 窄带半宽（像素）
+
+    返回 精确定位后的直线 (rho, theta)
+    '''
+    rho, theta = line
+    c, s = math.cos(theta), math.sin(theta)
+    height, width = gray_img.shape[:2]
+
+    # 窄带的外接矩形，只对该区域求边界
+    if abs(s) >= abs(c):
+        # 水平线 y = (rho - x cos) / sin
+        ys = [(rho - x * c) / s for x in (0, width - 1)]
+        y0, y1 = max(int(min(ys) - band / abs(s)) - 1, 0), min(int(max(ys) + band / abs(s)) + 2, height)
+        x0, x1 = 0, width
+    else:
+        # 垂直线 x = (rho - y sin) / cos
+        xs = [(rho - y * s) / c for y in (0, height - 1)]
+        x0, x1 = max(int(min(xs) - band / abs(c)) - 1, 0), min(int(max(xs) + band / abs(c)) + 2, width)
+        y0, y1 = 0, height
+    if x0 >= x1 or y0 >= y1:
+        return line
+
+    edge_y, edge_x = np.nonzero(cv2.Canny(gray_img[y0:y1, x0:x1], *canny_thresholds))
+    # 各边界点所在的平行直线的 rho，只保留窄带内的点
+    offsets = (edge_x + x0) * c + (edge_y + y0) * s - rho
+    offsets = offsets[np.abs(offsets) <= band]
+    if len(offsets) == 0:
+        return line
+
+    # 取边界点最集中的位置，直线两侧的边界取平均即为直线中心
+    hist = np.bincount(np.round(offsets + band).astype(int), minlength=int(2 * band) + 1).astype(float)
+    hist = np.convolve(hist, np.ones(5), mode='same')
+    peak = hist.argmax()
+    lo, hi = max(peak - 3, 0), min(peak + 4, len(hist))
+    mask = (offsets + band >= lo - 0.5) & (offsets + band < hi - 0.5)
+    return (rho + float(np.mean(offsets[mask])), theta)
+
+
+def _to_position(line, center, horizontal):
+    '''
+    直线 (rho, theta) 转为 (位置, 角度)
+
+    水平线位置为直线在 x = center 处的 y 值，垂直线为 y = center 处的 x 值；
+    垂直线的 theta 折算到 (-pi/2, pi/2]，便于插值
+    '''
+    rho, theta = line
+    if horizontal:
+        return (rho - center * math.cos(theta)) / math.sin(theta), theta
+    if theta > np.pi / 2:
+        rho, theta = -rho, theta - np.pi
+    return (rho - center * math.sin(theta)) / math.cos(theta), theta
+
+
+def _from_position(position, theta, center, horizontal):
+    '''(位置, 角度) 转为直线 (rho, theta)'''
+    if horizontal:
+        return (center * math.cos(theta) + position * math.sin(theta), theta)
+    rho = position * math.cos(theta) + center * math.sin(theta)
+    if theta < 0:
+        rho, theta = -rho, theta + np.pi
+    return (rho, theta)
+
+
+def _lattice_inliers(positions, spacing):
+    '''以每条直线为基准，落在间距为 spacing 的格子上的直线数量'''
+    offsets = positions[None, :] - positions[:, None]
+    residuals = np.abs(offsets - np.round(offsets / spacing) * spacing)
+    return residuals, (residuals <= spacing / 8).sum(axis=1)
+
+
+def _estimate_spacing(position_lists):
+    '''
+    由两个方向的所有直线估计格子间距
+
+    以相邻直线距离及其 1/2、1/3 为候选，取落在格子上的直线接近最多的候选中最大的一个，
+    被遮挡而缺失的直线不影响估计；无法估计时返回 None
+    '''
+    position_lists = [np.sort(positions) for positions in position_lists]
+    diffs = np.concatenate([np.diff(positions) for positions in position_lists])
+    # 间距过小（小于 8 像素）时无法区分棋子，不作为候选
+    candidates = sorted(set(d / k for d in diffs for k in (1, 2, 3) if d / k >= 8), reverse=True)
+    if not candidates:
+        return None
+    scores = [sum(_lattice_inliers(positions, spacing)[1].max() for positions in position_lists) \
+              for spacing in candidates]
+    # 间距的一半也总能对齐所有直线，且可能额外对齐个别干扰直线，因此取得分接近最高的候选中最大的一个
+    best_score = max(scores)
+    for spacing, score in zip(candidates, scores):
+        if score >= 0.8 * best_score:
+            return spacing
+
+
+def _fit_lattice(positions, thetas, spacing):
+    '''
+    将一组平行直线对齐到间距约为 spacing 的等间距格子
+
+    返回 (各直线的格子序号, 保留的直线在输入中的序号, 起点位置, 间距, 角度起点, 角度变化率)，无法对齐时返回 None
+    '''
+    order = np.argsort(positions)
+    positions, thetas = np.asarray(positions)[order], np.asarray(thetas)[order]
+
+    # 以落在格子上的直线最多的直线为基准，分配格子序号，去掉偏离格子过远或重复的直线
+    residuals, inliers = _lattice_inliers(positions, spacing)
+    anchor = inliers.argmax()
+    index = np.round((positions - positions[anchor]) / spacing).astype(int)
+    keep = residuals[anchor] <= spacing / 8
+    index, positions, thetas, order = index[keep], positions[keep], thetas[keep], order[keep]
+    index, first = np.unique(index, return_index=True)
+    positions, thetas, order = positions[first], thetas[first], order[first]
+    if len(index) < 2:
+        return None
+
+    # 最小二乘拟合 位置 = a + 间距 * 序号，角度 = c + d * 序号（透视时直线角度逐渐变化）
+    spacing, start = np.polyfit(index, positions, 1)
+    d_theta, theta0 = np.polyfit(index, thetas, 1)
+    return index - index[0], order, start + spacing * index[0], spacing, theta0 + d_theta * index[0], d_theta
+
+
+def _line_support(close, line, horizontal, lo, hi):
+    '''直线在 lo 到 hi 范围内（水平线为 x 范围，垂直线为 y 范围）经过边界点的比例'''
+    rho, theta = line
+    c, s = math.cos(theta), math.sin(theta)
+    count = 0
+    samples = np.linspace(lo, hi, 50)
+    for t in samples:
+        if horizontal:
+            x, y = int(round(t)), int(round((rho - t * c) / s))
+        else:
+            x, y = int(round((rho - t * s) / c)), int(round(t))
+        if not _in_image(close, x, y):
+            return -1
+        if 255 in close[max(y - 2, 0): y + 3, max(x - 2, 0): x + 3]:
+            count += 1
+    return count / len(samples)
+
+
+def _fit_board_lines(horizontal_lines, vertical_lines, close, board_sizes):
+    '''
+    按等间距格子补全棋盘直线，使棋盘大小为最接近的合法大小
+
+    返回 (水平直线列表, 垂直直线列表)，无法补全时返回 None
+    '''
+    height, width = close.shape[:2]
+    groups = []
+    for lines, horizontal, center in ((horizontal_lines, True, width / 2), (vertical_lines, False, height / 2)):
+        positions, thetas = zip(*[_to_position(line, center, horizontal) for line in lines])
+        groups.append((lines, horizontal, center, np.array(positions), np.array(thetas)))
+    spacing = _estimate_spacing([group[3] for group in groups])
+    if spacing is None:
+        return None
+
+    fits = []
+    for lines, horizontal, center, positions, thetas in groups:
+        fit = _fit_lattice(positions, thetas, spacing)
+        if fit is None:
+            return None
+        # 两个方向都使用共同估计的间距拟合，各自拟合得到的间距另存
+        index, order, start, fit_spacing, theta0, d_theta = fit
+        # 检测到的直线按格子序号保留，缺失的直线由拟合结果补全
+        detected = {int(i): lines[j] for i, j in zip(index, order)}
+        fits.append([0, index[-1], start, fit_spacing, theta0, d_theta, horizontal, center, detected])
+
+    # 棋盘为正方形，取不小于两个方向直线数量的最小合法大小
+    size = max(f[1] - f[0] + 1 for f in fits)
+    legal = [n for n in sorted(board_sizes) if n >= size]
+    if not legal:
+        return None
+    size = legal[0]
+
+    def make_line(f, i):
+        first, last, start, spacing, theta0, d_theta, horizontal, center, detected = f
+        if i in detected:
+            return detected[i]
+        return _from_position(start + spacing * i, theta0 + d_theta * i, center, horizontal)
+
+    def extent(f):
+        '直线所在的范围：另一方向第一条与最后一条直线的位置'
+        first, last, start, spacing = f[:4]
+        return start + spacing * first, start + spacing * last
+
+    # 每次在边界支持度较高的一侧增加一条直线，直到达到合法大小
+    for k, f in enumerate(fits):
+        other = fits[1 - k]
+        while f[1] - f[0] + 1 < size:
+            lo, hi = extent(other)
+            before = _line_support(close, make_line(f, f[0] - 1), f[6], lo, hi)
+            after = _line_support(close, make_line(f, f[1] + 1), f[6], lo, hi)
+            if before < 0 and after < 0:
+                # 两侧都超出图像
+                return None
+            if before > after:
+                f[0] -= 1
+            else:
+                f[1] += 1
+
+    return tuple([make_line(f, i) for i in range(f[0], f[1] + 1)] for f in fits)
+
+
+def get_cross_points(gray_img, canny_thresholds=(100, 255), close_times=1, line_threshold=300, r_error=10, t_error=10*np.pi/180, work_size=None, method='hough', board_sizes=None):
+    '''
+    获取灰度图像中水平直线、垂直直线的交点坐标
+
+    gray_img: 灰度图像
+
+    canny_thresholds: Canny 算法获取图像边界的两个阈值
+
+    close_times: 形态学闭运算次数
+
+    line_threshold: Hough 变换检测直线的投票阈值，即直线上至少有多少个边界像素；
+                    不大于 1 时表示相对于检测所用图像短边的比例，与图像分辨率和宽高比无关
+
+    r_error: Hough 变换检测直线时，r 值之差小于 r_error 认为是相似直线
+
+    t_error: Hough 变换检测直线时，theta 值之差小于 t_error 认为是相似直线
+
+    work_size: 图像长边大于该值时，先在缩小到该尺寸的图像上检测棋盘，再在原图中精确定位直线，
+               此时 line_threshold（投票数或比例）、r_error 均相对于缩小后的图像；None 表示直接在原图上检测
+
+    method: 直线检测方法，'hough' 对整幅边界图像做 Hough 变换，
+            'segment' 用概率 Hough 变换检测接近水平、垂直的线段，再将共线线段合并为直线
+
+    board_sizes: 合法的棋盘大小，如 (9, 13, 19)。按所有直线估计格子间距，补全被遮挡或未检测到的直线，
+                 使棋盘大小为不小于检测结果的最接近的合法大小；None 表示不补全
+
+    返回 二值图像（检测所用分辨率），numpy 三维数组，前两维表示交点的顺序，最后一维长度为 2 ，表示交点 x, y 坐标
+    '''
+    # 在缩小的图像上检测棋盘，阈值均相对于缩小后的图像
+    scale = 1
+    work_img = gray_img
+    if work_size is not None and max(gray_img.shape[:2]) > work_size:
+        scale = work_size / max(gray_img.shape[:2])
+        work_img = cv2.resize(gray_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if line_threshold <= 1:
+        # 相对于检测所用图像短边的比例，换算为投票数（直线像素数）
+        line_threshold = max(int(round(line_threshold * min(work_img.shape[:2]))), 1)
+
+    close, horizontal_lines, vertical_lines = _detect_lines(work_img, canny_thresholds, close_times, line_threshold, r_error, t_error, method)
+
+    if len(horizontal_lines) < 3 or len(vertical_lines) < 3:
+        # 直线数量不足，认为没找到
+        return close, None
+
+    # 求得所有交点，过滤不在棋盘上的直线
+    points = _intersect_lines(horizontal_lines, vertical_lines)
+    top, bottom, left, right = _board_range(points, close)
+    if bottom - top < 2 or right - left < 2:
+        # 棋盘上的直线数量不足，认为没找到
+        return close, None
+
+    horizontal_lines = horizontal_lines[top: bottom + 1]
+    vertical_lines = vertical_lines[left: right + 1]
+
+    if board_sizes is not None:
+        # 补全缺失的直线，使棋盘大小为最接近的合法大小
+        lines = _fit_board_lines(horizontal_lines, vertical_lines, close, board_sizes)
+        if lines is None:
+            return close, None
+        horizontal_lines, vertical_lines = lines
+
+    if scale == 1:
+        # 精确地坐标
+        return close, _intersect_lines(horizontal_lines, vertical_lines)
+
+    # 将棋盘上的直线换算到原图，并在原图中直线附近的窄带内精确定位
+    band = 2 / scale + 2
+    horizontal_lines = [_refine_line(gray_img, (rho / scale, theta), band, canny_thresholds) \
+                        for rho, theta in horizontal_lines]
+    vertical_lines = [_refine_line(gray_img, (rho / scale, theta), band, canny_thresholds) \
+                      for rho, theta in vertical_lines]
+    points = _intersect_lines(horizontal_lines, vertical_lines)
+
     return close, points
+
+
+def grid_spacing(points):
+    '由所有相邻交点的距离估计棋盘格子间距（中值），不受个别交点误差影响'
+    points = np.asarray(points, dtype=float)
+    dx = np.hypot(*np.moveaxis(np.diff(points, axis=1), -1, 0))
+    dy = np.hypot(*np.moveaxis(np.diff(points, axis=0), -1, 0))
+    return float(np.median(np.concatenate((dx.ravel(), dy.ravel()))))
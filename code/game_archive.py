@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+'''
+棋局归档
+
+将大量 GoProcess 分析结果按列存储到一个目录中，每列一个二进制文件，可追加写入，
+读取时通过 numpy.memmap 映射，统计查询只读取用到的列。
+
+目录结构：
+    games.<列名>.bin   每局一行：棋盘大小、回合/提子在对应表中的起点和数量、元数据位置
+    rounds.<列名>.bin  每回合一行：所属棋局、回合序号、帧数、下棋方、动作、落子坐标、提子数
+    takes.<列名>.bin   每个被提棋子一行：所属棋局、回合序号、坐标、棋子序号
+    meta.jsonl         每局一行 json 元数据
+'''
+
+import json
+import os
+
+import numpy as np
+
+import go_process as gp
+
+
+'各表的列及数据类型'
+TABLES = {
+    'games': [('board_size', '<u2'), ('round_start', '<u8'), ('round_count', '<u4'),
+              ('take_start', '<u8'), ('take_count', '<u4'), ('meta_offset', '<u8'), ('meta_length', '<u4')],
+    'rounds': [('game', '<u4'), ('round_no', '<u4'), ('frame', '<i8'), ('who', 'u1'), ('action', 'u1'),
+               ('x', 'i1'), ('y', 'i1'), ('take_count', '<u2')],
+    'takes': [('game', '<u4'), ('round_no', '<u4'), ('x', 'u1'), ('y', 'u1'), ('no', '<u4')],
+}
+
+
+class GameArchive(object):
+    '棋局归档类'
+
+    def __init__(self, path):
+        '打开（或创建）归档目录'
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._truncate_incomplete()
+
+
+    def _column_path(self, table, name):
+        return os.path.join(self.path, '{}.{}.bin'.format(table, name))
+
+
+    def _truncate_file(self, path, size):
+        '将文件截断到 size 字节'
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+
+    def _truncate_incomplete(self):
+        '删除写入中断时留下的不完整数据，使各表只包含已完整写入的棋局'
+        # 棋局表各列逐个写入，以最短的列为准
+        games = min(os.path.getsize(self._column_path('games', name)) // np.dtype(dtype).itemsize \
+                    if os.path.exists(self._column_path('games', name)) else 0 for name, dtype in TABLES['games'])
+        for name, dtype in TABLES['games']:
+            self._truncate_file(self._column_path('games', name), games * np.dtype(dtype).itemsize)
+
+        counts = {'rounds': 0, 'takes': 0}
+        meta_size = 0
+        if games > 0:
+            last = {name: int(self.column('games', name)[games - 1]) for name, dtype in TABLES['games']}
+            counts['rounds'] = last['round_start'] + last['round_count']
+            counts['takes'] = last['take_start'] + last['take_count']
+            meta_size = last['meta_offset'] + last['meta_length']
+        for table, count in counts.items():
+            for name, dtype in TABLES[table]:
+                self._truncate_file(self._column_path(table, name), count * np.dtype(dtype).itemsize)
+        self._truncate_file(os.path.join(self.path, 'meta.jsonl'), meta_size)
+
+
+    def _count(self, table):
+        '表的行数'
+        name, dtype = TABLES[table][0]
+        path = self._column_path(table, name)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // np.dtype(dtype).itemsize
+
+
+    def __len__(self):
+        '棋局数量'
+        return self._count('games')
+
+
+    def column(self, table, name):
+        '''读取一列数据（内存映射，不载入内存）
+
+        table: 表名 games, rounds, takes
+
+        name: 列名
+        '''
+        dtype = np.dtype(dict(TABLES[table])[name])
+        count = self._count(table)
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._column_path(table, name), dtype=dtype, mode='r', shape=(count,))
+
+
+    def _append_rows(self, table, columns):
+        '向表中追加若干行'
+        for name, dtype in TABLES[table]:
+            with open(self._column_path(table, name), 'ab') as f:
+                f.write(np.asarray(columns[name], dtype=dtype).tobytes())
+
+
+    def append(self, go_process, metadata=None):
+        '''将一局 GoProcess 结果追加到归档中
+
+        metadata: 元数据 dict，如视频路径、对局者
+
+        返回 棋局序号
+        '''
+        game = len(self)
+        rounds = {name: [] for name, dtype in TABLES['rounds']}
+        takes = {name: [] for name, dtype in TABLES['takes']}
+
+        for rd in go_process.process:
+            frame_no = getattr(rd, 'frame_no', None)
+            x, y = (-1, -1) if rd.action == gp.ACT_GIVE_UP else rd.down[:2]
+            for name, value in (('game', game), ('round_no', rd.round_no), ('frame', -1 if frame_no is None else frame_no),
+                                ('who', rd.who), ('action', rd.action), ('x', x), ('y', y), ('take_count', len(rd.take))):
+                rounds[name].append(value)
+            for x, y, no in rd.take:
+                for name, value in (('game', game), ('round_no', rd.round_no), ('x', x), ('y', y), ('no', no or 0)):
+                    takes[name].append(value)
+
+        meta_path = os.path.join(self.path, 'meta.jsonl')
+        meta_offset = os.path.getsize(meta_path) if os.path.exists(meta_path) else 0
+        meta_text = (json.dumps(metadata or {}, ensure_ascii=False) + '\n').encode('utf-8')
+
+        # 最后写入棋局表，棋局表的一行写入后该局才算完整
+        games = {'board_size': [go_process.shape[0]], 'round_start': [self._count('rounds')],
+                 'round_count': [len(go_process.process)], 'take_start': [self._count('takes')],
+                 'take_count': [len(takes['game'])], 'meta_offset': [meta_offset], 'meta_length': [len(meta_text)]}
+        self._append_rows('rounds', rounds)
+        self._append_rows('takes', takes)
+        with open(meta_path, 'ab') as f:
+            f.write(meta_text)
+        self._append_rows('games', games)
+        return game
+
+
+    def get_metadata(self, game):
+        '读取一局的元数据'
+        offset = int(self.column('games', 'meta_offset')[game])
+        length = int(self.column('games', 'meta_length')[game])
+        with open(os.path.join(self.path, 'meta.jsonl'), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))
+
+
+    def get_rounds(self, game):
+        '读取一局的所有回合，返回 {列名: 数组}'
+        start = int(self.column('games', 'round_start')[game])
+        end = start + int(self.column('games', 'round_count')[game])
+        return {name: self.column('rounds', name)[start:end] for name, dtype in TABLES['rounds']}
+
+
+    def move_numbers(self):
+        '各回合是所在棋局的第几手（停一手不计入，停一手回合的值与上一手相同）'
+        count = self._count('rounds')
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        moves = np.cumsum(self.column('rounds', 'action') != gp.ACT_GIVE_UP)
+        # 减去各局开始之前的着手数
+        start = self.column('games', 'round_start')[self.column('rounds', 'game')].astype(np.int64)
+        before = np.where(start > 0, moves[np.maximum(start - 1, 0)], 0)
+        return moves - before
+
+
+    def games_with_capture_before(self, move_no):
+        '查询在第 move_no 手之前（不含）有提子的棋局序号，手数不计停一手'
+        mask = (self.column('rounds', 'take_count') > 0) & (self.move_numbers() < move_no)
+        return np.unique(self.column('rounds', 'game')[mask])
+
+
+
+def export_go_processes(path, go_processes, metadata_list=None):
+    '''将已有的多个 GoProcess 对象导出到归档
+
+    metadata_list: 与 go_processes 对应的元数据列表
+
+    返回 GameArchive 对象
+    '''
+    archive = GameArchive(path)
+    if metadata_list is None:
+        metadata_list = [None] * len(go_processes)
+    for go_process, metadata in zip(go_processes, metadata_list):
+        archive.append(go_process, metadata)
+    return archive
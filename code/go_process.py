@@ -4,7 +4,11 @@
 围棋进程记录
 '''
 
-import numpy as np
+import collections
+
+from lazy_import import lazy_import
+
+np = lazy_import('numpy')
 
 '空白'
 QI_BLANK = 0
@@ -35,6 +39,8 @@ class Round(object):
         self.down = None
         '提子坐标：[(x, y, 序号), (x, y, 序号)...]'
         self.take = []
+        '回合所在视频帧数'
+        self.frame_no = None
     
     
     def __str__(self):
@@ -61,6 +67,8 @@ class GoProcess(object):
     __round_start = 1
     # 回合结束表示
     __round_end = 2
+    # 查询结果缓存的最大条目数
+    cache_size = 128
 
 
     def __init__(self, shape):
@@ -70,19 +78,75 @@ class GoProcess(object):
         self.process = []
         '史棋盘棋子布局'
         self.__qiju1 = np.zeros(shape, dtype=int)
-        '新棋盘棋子布局'
-        self.__qiju2 = None
+        '新棋盘棋子布局，与史棋盘交替使用，避免每回合重新分配'
+        self.__qiju2 = np.zeros(shape, dtype=int)
+        '最后确认的棋盘棋子布局，只在确认回合时更新，通过 get_board 只读访问'
+        self.__board = np.zeros(shape, dtype=int)
+        self.__init_board_view()
+        '棋盘变化'
+        self.__status = np.zeros(shape, dtype=int)
         '回合状态'
         self.__round_status = self.__round_end
         '落子计数'
         self.__down_count = 0
         '落子棋子坐标'
         self.__down_list = []
+        self.__init_cache()
+    
+
+    def __init_board_view(self):
+        '创建最后确认的棋盘的只读视图'
+        self.__board_view = self.__board.view()
+        self.__board_view.flags.writeable = False
+    
+
+    def __init_cache(self):
+        '初始化查询结果缓存'
+        '各回合的落子状态 {round_no: down_list 元组}，回合只会追加，已缓存的结果始终有效'
+        self.__down_list_cache = collections.OrderedDict()
+        '各回合的 sgf 棋谱文本 {round_no: text}'
+        self.__sgf_cache = collections.OrderedDict()
+        'sgf 走子文本前缀，只增长'
+        self.__sgf_prefix = ''
+        'sgf 走子文本前缀中各回合结束的位置'
+        self.__sgf_offsets = [0]
+    
+
+    def __cache_get(self, cache, round_no):
+        '读取缓存结果，不存在时返回 None'
+        value = cache.get(round_no)
+        if value is not None:
+            cache.move_to_end(round_no)
+        return value
+    
+
+    def __cache_put(self, cache, round_no, value):
+        '保存缓存结果，超过最大条目数时删除最久未使用的结果'
+        cache[round_no] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+    
+
+    def __getstate__(self):
+        '序列化时不保存查询缓存和只读视图'
+        state = self.__dict__.copy()
+        for name in ('__down_list_cache', '__sgf_cache', '__sgf_prefix', '__sgf_offsets', '__board_view'):
+            state.pop('_GoProcess' + name, None)
+        return state
+    
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_GoProcess__board' not in state:
+            # 旧版本没有单独保存最后确认的棋盘
+            self.__board = self.__qiju1.copy()
+        self.__init_board_view()
+        self.__init_cache()
     
 
     def round_start(self):
         '回合开始'
-        self.__qiju2 = np.zeros(self.shape, dtype=int)
+        self.__qiju2.fill(QI_BLANK)
         self.__round_status = self.__round_start
     
 
@@ -91,9 +155,14 @@ class GoProcess(object):
         self.__qiju2[y, x] = qizi_type
     
 
-    def round_end(self):
-        '回合结束'
-        status = self.__qiju2 - self.__qiju1
+    def found_board(self, board):
+        '发现整个棋盘的棋子\n\nboard: 棋子类型二维数组'
+        self.__qiju2[:] = board
+    
+
+    def round_end(self, frame_no=None):
+        '回合结束\n\nframe_no: 当前视频帧数，记录到回合中'
+        status = np.subtract(self.__qiju2, self.__qiju1, out=self.__status)
 
         blacks = []  # 记录黑棋坐标
         whites = []  # 记录白棋坐标
@@ -215,11 +284,20 @@ class GoProcess(object):
         if rd.who == None:
             # 其他落子情况
             return None, None
-        # 更新棋盘
-        self.__qiju1 = self.__qiju2
+        # 更新棋盘，交换两个棋盘缓冲区
+        self.__qiju1, self.__qiju2 = self.__qiju2, self.__qiju1
+        self.__board[:] = self.__qiju1
+        rd.frame_no = frame_no
+        if rd0 is not None:
+            rd0.frame_no = frame_no
         return rd0, rd
     
 
+    def get_board(self):
+        '获得最后确认的棋盘棋子布局，返回只读的 numpy 二维数组，确认新回合时内容随之更新'
+        return self.__board_view
+    
+
     def __take_in_down_list(self, _x, _y, _down_list=None):
         '在 down_list 中提子，返回该棋子 down_count'
         if _down_list == None:
@@ -235,13 +313,22 @@ class GoProcess(object):
     def get_down_list(self, round_no=None):
         '''获得指定回合落子状态
 
-        round_no: 指定的回合，None 表示到最后一回合
+        round_no: 指定的回合，None 表示到最后一回合，小于 0 时与 0 相同
+
+        返回新的列表 [(x, y, 序号, 棋子类型), ...]
         '''
         if round_no == None:
             round_no = len(self.process)
+        round_no = max(round_no, 0)
+
+        down_list = self.__cache_get(self.__down_list_cache, round_no)
+        if down_list is not None:
+            return list(down_list)
         
-        down_list = []
-        for i in range(round_no):
+        # 从之前最近的已缓存回合开始计算
+        start = max([n for n in self.__down_list_cache if n < round_no], default=0)
+        down_list = list(self.__down_list_cache[start]) if start in self.__down_list_cache else []
+        for i in range(start, round_no):
             rd = self.process[i]
             if rd.action == ACT_GIVE_UP:
                 # 如果停一手，down 为 None
@@ -251,29 +338,42 @@ class GoProcess(object):
             for x, y, no in rd.take:
                 self.__take_in_down_list(x, y, down_list)
         
+        # 缓存不可修改的元组，调用者修改返回的列表不影响缓存
+        self.__cache_put(self.__down_list_cache, round_no, tuple(down_list))
         return down_list
     
 
     def get_sgf_text(self, round_no=None):
         '''获取sgf棋谱文本
 
-        round_no: 指定的回合，None 表示到最后一回合
+        round_no: 指定的回合，None 表示到最后一回合，小于 0 时与 0 相同
         '''
         co = 'abcdefghijklmnopqrstuvwxyz'  # 棋谱坐标
-        text = ''  # 描述信息
 
         if round_no == None:
             round_no = len(self.process)
+        round_no = max(round_no, 0)
+
+        text = self.__cache_get(self.__sgf_cache, round_no)
+        if text is not None:
+            return text
         
-        for i in range(round_no):
-            rd = self.process[i]
+        # 走子文本前缀只需补充新的回合
+        texts = [self.__sgf_prefix]
+        offset = self.__sgf_offsets[-1]
+        for rd in self.process[len(self.__sgf_offsets) - 1:round_no]:
             who = ';B[{}{}]' if rd.who == QI_BLACK else ';W[{}{}]'
             if rd.down == None:
-                text += who.format('', '')
+                texts.append(who.format('', ''))
             else:
-                text += who.format(co[rd.down[0]], co[rd.down[1]])
+                texts.append(who.format(co[rd.down[0]], co[rd.down[1]]))
+            offset += len(texts[-1])
+            self.__sgf_offsets.append(offset)
+        self.__sgf_prefix = ''.join(texts)
         
-        return '(;SZ[{}]\n{})'.format(self.shape[0], text)
+        text = '(;SZ[{}]\n{})'.format(self.shape[0], self.__sgf_prefix[:self.__sgf_offsets[round_no]])
+        self.__cache_put(self.__sgf_cache, round_no, text)
+        return text
             
         
 
@@ -10,15 +10,19 @@ date: 2017年5月16日 星期二
 
 
 import os
-import sys
-import itertools
-import math
+import pickle
 
-import cv2
 import numpy as np
 
+from lazy_import import lazy_import
 import go_process as gp
-from cross_point import get_cross_points
+from cross_point import get_cross_points, grid_spacing
+from qizi_classifier import LutClassifier
+import color_calibration
+import timeline
+
+cv2 = lazy_import('cv2')
+multiprocessing = lazy_import('multiprocessing')
 
 
 
@@ -26,21 +30,31 @@ from cross_point import get_cross_points
 class GoVideoAnalyzer(object):
     '围棋视频分析类'
 
-    def _is_black(self, hsv):
-        '是否是黑色棋子'
-        # return (abs(hsv - _black_hsv) <= self.qizi_color_threshold).all()
-        return abs(float(hsv[2] - self._black_hsv[2])) <= self.qizi_color_threshold
+    def _get_qizi_index(self, frame_shape, r):
+        '''生成所有交叉点棋子范围的像素索引表
 
+        frame_shape: 视频帧图像尺寸
 
-    def _is_white(self, hsv):
-        '是否是白色棋子'
-        return (abs(hsv - self._white_hsv) <= self.qizi_color_threshold).all()
+        r: 棋子范围宽度
 
+        返回 numpy 二维数组，每行为一个交叉点棋子范围内各像素在展平图像中的序号
+        '''
+        r = max(r, 1)
+        height, width = frame_shape[:2]
+        # 棋子范围为交叉点左下方 r×r 的区域，超出图像边界时平移到图像内
+        left = np.clip(self.points[..., 0] - 2 * r, 0, width - r).reshape(-1, 1, 1)
+        top = np.clip(self.points[..., 1] + r, 0, height - r).reshape(-1, 1, 1)
+        offset = np.arange(r)
+        index = (top + offset.reshape(1, -1, 1)) * width + (left + offset.reshape(1, 1, -1))
+        return index.reshape(index.shape[0], -1)
     
-    def _get_qizi_area_fun(self, r):
-        '传入棋子范围宽度，返回获取棋子范围函数'
-        # np.s_[] 返回切片元组 tuple of slice
-        return lambda x, y: np.s_[y+r:y+2*r,x-2*r:x-r,:]
+
+    def _get_qizi_hsv(self, frame_hsv):
+        '获取所有交叉点棋子范围的 hsv 颜色中值，返回值使用复用的缓冲区，下次调用时会被覆盖'
+        # 一次取出所有棋子范围的像素，分别计算 h s v 的中值
+        np.take(frame_hsv.reshape(-1, 3), self.qizi_index, axis=0, out=self._qizi_pixels)
+        np.median(self._qizi_pixels, axis=1, out=self._qizi_hsv, overwrite_input=True)
+        return self._qizi_hsv.reshape(self.points.shape[:2] + (3,))
     
 
     def _draw_board_coordinate(self, im):
@@ -57,23 +71,51 @@ class GoVideoAnalyzer(object):
         self._black_hsv = np.array([0, 0, 20])  # 黑色棋子 hsv 颜色  
         self._white_hsv = np.array([19, 24, 230.5])  # 白色棋子 hsv 颜色
         self.qizi_color_threshold = 20  # 棋子 hsv 颜色允许阈值
+        self.classifier = None  # 棋子分类器，为 None 时使用颜色查找表分类器
+        self.confidence_threshold = 0.25  # 置信度低于该值的交点发生变化时，重新采样附近帧确认
+        self.resample_count = 4  # 重新采样的附近帧数，为 0 时不重新采样
+        self.confidence = None  # 最近一帧各交点的置信度
 
+        self.video_path = None  # 视频文件路径
         self.cap = None  # cv2 capture
         self.frame_count = 0  # 视频总帧数
         self.cur_frame_count = 0  # 当前帧数
         self.frame_step = 1  # 播放帧数步长
+        self.coarse_factor = 4  # 每隔多少个采样帧分析一次棋局，有变化时再分析其间的采样帧，为 1 时逐帧分析
+        self.seek_distance = 300  # 向后跳转超过该帧数时使用 seek，否则顺序 grab 跳过
+        self._scanner = None  # next_round 使用的两级扫描生成器
+        self._pending_frames = []  # 两级扫描中等待分析的采样帧缓冲区
         self.go_board_im = None  # 围棋棋盘图像
+        # 棋盘交点检测参数，先在长边缩小到 work_size 的图像上检测，阈值均相对于缩小后的图像
+        # line_threshold 为直线长度相对于图像短边的比例，2/3 即原来 750 像素高的画面上的 500 票
+        # method 为 'segment' 时使用线段检测，画面中有较多棋子、手等干扰时更稳定
+        # board_sizes 为合法的棋盘大小，部分检测到的棋盘会被补全到最接近的合法大小
+        self.cross_point_kw = {'canny_thresholds': (100, 255), 'close_times': 1, 'line_threshold': 2 / 3, \
+                               'r_error': 10, 't_error': 10*np.pi / 180, 'work_size': 800, 'method': 'hough', \
+                               'board_sizes': (9, 13, 19)}
 
         self.go_process = None  # 创建围棋进程记录对象
         self.points = None  # 交点坐标
         self.r = 0  # 棋子半径
-        self.qizi_area = None  # 棋子范围函数
+        self.qizi_index = None  # 棋子范围像素索引表
+        self._qizi_pixels = None  # 棋子范围像素缓冲区
+        self._qizi_hsv = None  # 棋子范围颜色中值缓冲区
+        self._frame = None  # 视频帧缓冲区
+        self._frame_hsv = None  # hsv 视频帧缓冲区
+        self._uncertain = None  # 低置信度交点缓冲区
+        self._changed = None  # 棋局变化交点缓冲区
+
+        self.checkpoint_path = None  # 检查点文件路径，为 None 时不保存检查点
+        self.checkpoint_interval = 1000  # 每隔多少帧保存一次检查点
+        self._checkpoint_frame = 0  # 上次保存检查点时的帧数
 
     
 
     def load_video(self, video_path, frame_step=None):
         '加载视频文件'
+        self.video_path = video_path
         self.cap = cv2.VideoCapture(video_path)
+        self._scanner = None
 
         if self.cap.isOpened() == False:
             return (False, None)
@@ -95,22 +137,83 @@ class GoVideoAnalyzer(object):
         # 转化为灰度图像
         im_gray = cv2.cvtColor(self.go_board_im, cv2.COLOR_BGR2GRAY)
 
-        kw = {'canny_thresholds': (100, 255), 'close_times': 1, \
-               'line_threshold': 500, 'r_error': 10, 't_error': 10*np.pi / 180}
-
-        bin_img, self.points = get_cross_points(im_gray, **kw)
+        bin_img, self.points = get_cross_points(im_gray, **self.cross_point_kw)
     
         # 是否成功找到交点
         if self.points is None:
             return (False, None)
         
-        self.r = int(self.points[0, 1, 0] - self.points[0, 0, 0])  # 获取棋子半径
-        self.qizi_area = self._get_qizi_area_fun(self.r // 6)  # 棋子范围函数
-        self.go_process = gp.GoProcess(self.points.shape[:2])  # 创建围棋进程记录对象
+        self._init_points(self.points, self.go_board_im.shape)
+
+        if self.classifier is None:
+            self._init_classifier()
+        else:
+            frame_hsv = cv2.cvtColor(self.go_board_im, cv2.COLOR_BGR2HSV)
+            self.classifier.calibrate(self._get_qizi_hsv(frame_hsv))
 
         return (True, self.points)
     
 
+    def _init_points(self, points, frame_shape):
+        '根据交点坐标初始化棋子范围和围棋进程记录'
+        self.points = points
+        self.r = int(round(grid_spacing(self.points)))  # 由所有交点估计棋子半径（格子间距）
+        # 棋子范围像素索引表，每个视频只计算一次
+        self.qizi_index = self._get_qizi_index(frame_shape, self.r // 6)
+        self._qizi_pixels = np.empty(self.qizi_index.shape + (3,), dtype=np.uint8)
+        self._qizi_hsv = np.empty((self.qizi_index.shape[0], 3))
+        self._uncertain = np.empty(self.points.shape[:2], dtype=bool)  # 低置信度交点缓冲区
+        self._changed = np.empty(self.points.shape[:2], dtype=bool)  # 棋局变化交点缓冲区
+        self.go_process = gp.GoProcess(self.points.shape[:2])  # 创建围棋进程记录对象
+        self._scanner = None  # 扫描生成器与旧的围棋进程记录绑定，需重新创建
+    
+
+    def _init_classifier(self):
+        '按当前参考颜色和阈值创建颜色查找表分类器（查找表分类器的 calibrate 不做任何事）'
+        self.classifier = LutClassifier(self._black_hsv, self._white_hsv, self.qizi_color_threshold)
+        frame_hsv = cv2.cvtColor(self.go_board_im, cv2.COLOR_BGR2HSV)
+        self.classifier.calibrate(self._get_qizi_hsv(frame_hsv))
+    
+
+    def calibrate_colors(self, sample_frames=10, sample_seconds=60, calibration_path=None):
+        '''根据开局若干帧自动校准棋子颜色，需在 analyze_cross_point 之后调用
+
+        sample_frames: 采样帧数
+
+        sample_seconds: 在视频开头多少秒内均匀采样
+
+        calibration_path: 校准文件路径（如每个摄像头一个文件），文件存在时直接读取，否则校准后保存
+
+        只有颜色查找表分类器按校准结果重建，自定义的分类器保持不变
+
+        返回 校准结果 dict
+        '''
+        if calibration_path is not None and os.path.exists(calibration_path):
+            calibration = color_calibration.load_calibration(calibration_path)
+        else:
+            # 在视频开头均匀采样
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            last_frame = min(self.frame_count - 1, sample_seconds * fps)
+            samples = []
+            for frame_no in np.linspace(0, last_frame, sample_frames).astype(int):
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+                ret, frame = self.cap.read()
+                if ret == False:
+                    break
+                samples.append(self._get_qizi_hsv(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)).copy())
+            calibration = color_calibration.calibrate_colors(np.array(samples), self._black_hsv, \
+                self._white_hsv, self.qizi_color_threshold)
+            if calibration_path is not None:
+                color_calibration.save_calibration(calibration_path, calibration)
+
+        self._black_hsv = calibration['black_hsv']
+        self._white_hsv = calibration['white_hsv']
+        self.qizi_color_threshold = calibration['threshold']
+        if self.classifier is None or isinstance(self.classifier, LutClassifier):
+            self._init_classifier()
+        return calibration
+    
+
     def mark_cross_point(self, radius=5, color=(0,0,255)):
         '标记交叉点'
         # 将二维点坐标用一维存储
@@ -125,38 +228,160 @@ class GoVideoAnalyzer(object):
         return im_mark
     
 
-    def next_round(self):
-        '获取下一个围棋回合'
+    def _seek(self, frame_no):
+        '将视频读取位置移到 frame_no，距离较近时顺序 grab 跳过（不解码图像），否则 seek'
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if 0 <= frame_no - position <= self.seek_distance:
+            for _ in range(frame_no - position):
+                if self.cap.grab() == False:
+                    break
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+    
 
-        # 直到有棋子落子，跳出
-        while True:
-            self.cur_frame_count += self.frame_step
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.cur_frame_count)
-            ret, frame = self.cap.read()
+    def _scan_frames(self, start, end, get_last_board):
+        '''两级扫描视频 [start, end) 中按步长采样的帧，逐个返回分析过的帧
+
+        采样帧先只解码到缓冲区，每 coarse_factor 个采样帧分析一次（粗扫描）；
+        棋局与上一棋局相同时，跳过缓冲的采样帧，否则按顺序分析缓冲的采样帧（细扫描）。
+        视频顺序读取，不向回跳转
+
+        get_last_board: 返回上一棋局的函数
+
+        生成 (帧数, 帧图像, 棋子类型二维数组, 置信度二维数组)，帧图像使用复用的缓冲区
+        '''
+        coarse_factor = max(int(self.coarse_factor), 1)
+        if len(self._pending_frames) < coarse_factor - 1:
+            self._pending_frames = [None] * (coarse_factor - 1)
+        pending = 0  # 缓冲区中尚未分析的采样帧数
+        pending_no = []  # 缓冲的采样帧帧数
+
+        for frame_no in range(start, int(end), self.frame_step):
+            self._seek(frame_no)
+            if self.cap.grab() == False:
+                break
+            if pending < coarse_factor - 1 and frame_no + self.frame_step < end:
+                # 粗扫描之间的采样帧只解码到缓冲区
+                ret, self._pending_frames[pending] = self.cap.retrieve(self._pending_frames[pending])
+                if ret:
+                    pending_no.append(frame_no)
+                    pending += 1
+                continue
+
+            ret, frame = self.cap.retrieve(self._frame)
+            if ret == False:
+                break
+            self._frame = frame
+            board, confidence = self._classify_frame(frame)
+            if pending > 0 and np.not_equal(board, get_last_board(), out=self._changed).any():
+                # 棋局有变化，细扫描缓冲的采样帧；缓冲帧的分类会覆盖分类器的输出缓冲区，先拷贝当前帧结果
+                board, confidence = board.copy(), confidence.copy()
+                for k in range(pending):
+                    yield (pending_no[k], self._pending_frames[k]) + self._classify_frame(self._pending_frames[k])
+            pending = 0
+            pending_no = []
+            yield frame_no, frame, board, confidence
+
+        # 视频提前结束，分析剩余的缓冲帧
+        for k in range(pending):
+            yield (pending_no[k], self._pending_frames[k]) + self._classify_frame(self._pending_frames[k])
+    
+
+    def _classify_frame(self, frame):
+        '确定一帧图像中所有棋子颜色，返回 (棋子类型二维数组, 置信度二维数组)'
+        # 棋局 hsv 颜色模式，写入复用的缓冲区
+        self._frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self._frame_hsv)
+        return self.classifier.classify_confidence(self._get_qizi_hsv(self._frame_hsv))
+    
+
+    def _resample_offsets(self):
+        '重新采样的附近帧相对于当前帧的偏移，均匀分布在前后半个步长内'
+        k = self.resample_count // 2
+        spacing = max(self.frame_step // (2 * k), 1) if k > 0 else 1
+        return [i * spacing for i in range(-k, k + 1) if i != 0]
+    
+
+    def _resample_board(self, frame_no, board, confidence, last_board):
+        '''低置信度的交点与上一棋局不同时，重新采样附近帧，按置信度加权投票确定这些交点的棋子
+
+        frame_no: 当前帧数
+
+        board, confidence: 当前帧的棋子类型和置信度
 
+        last_board: 上一棋局，用于判断哪些交点发生了变化
+
+        返回 修正后的棋子类型二维数组，视频读取位置保持不变
+        '''
+        if self.resample_count <= 0:
+            return board
+        uncertain = np.less(confidence, self.confidence_threshold, out=self._uncertain)
+        changed = np.not_equal(board, last_board, out=self._changed)
+        if not np.logical_and(uncertain, changed, out=changed).any():
+            return board
+
+        # 附近帧的分类会覆盖分类器的输出缓冲区，拷贝当前帧结果
+        board, confidence = board.copy(), confidence.copy()
+
+        votes = np.zeros((board.size, 3))
+        cells = np.arange(board.size)
+        # 置信度为 0 的结果也计入少量票数
+        votes[cells, board.ravel()] += confidence.ravel() + 1e-3
+
+        position = self.cap.get(cv2.CAP_PROP_POS_FRAMES)
+        for offset in self._resample_offsets():
+            if frame_no + offset < 0:
+                continue
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no + offset)
+            # 不使用帧缓冲区，当前帧图像仍需返回
+            ret, frame = self.cap.read()
             if ret == False:
-                return (False, )
+                continue
+            b, c = self._classify_frame(frame)
+            votes[cells, b.ravel()] += c.ravel() + 1e-3
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+
+        # 只修正低置信度的交点
+        voted = votes.argmax(axis=1).reshape(board.shape).astype(board.dtype)
+        return np.where(uncertain, voted, board)
+    
+
+    def next_round(self, stop=None):
+        '''获取下一个围棋回合
+
+        stop: 无参数函数，每分析完一帧且无新回合时调用，返回 True 时停止扫描并返回 (False, )，
+              调用者由 stop() 区分停止与视频结束；再次调用 next_round 从停止处继续
+
+        返回 (True, 标记后的帧图像, 停一手回合, 当前回合)，视频结束或停止时返回 (False, )
+        '''
+
+        if self._scanner is None:
+            self._scanner = self._scan_frames(self.cur_frame_count + self.frame_step, self.frame_count, \
+                                              self.go_process.get_board)
+
+        # 直到有棋子落子，跳出
+        for frame_no, frame, board, self.confidence in self._scanner:
+            self.cur_frame_count = frame_no
+            board = self._resample_board(self.cur_frame_count, board, self.confidence, self.go_process.get_board())
 
-            frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)  # 棋局 hsv 颜色模式
             self.go_process.round_start()
-            for y in range(self.points.shape[0]):
-                for x in range(self.points.shape[1]):
-                    # 确定棋子颜色
-                    # 分别计算 h s v 的中值
-                    qizi_x, qizi_y = self.points[y, x]
-                    hsv = np.median(frame_hsv[self.qizi_area(qizi_x, qizi_y)], axis=(0, 1))
-                    if self._is_black(hsv):
-                        # 黑色棋子
-                        self.go_process.found(x, y, gp.QI_BLACK)
-                    elif self._is_white(hsv):
-                        # 白色棋子
-                        self.go_process.found(x, y, gp.QI_WHITE)
-            rd0, rd = self.go_process.round_end()  # 回合结束，返回回合信息（可能有1回合或2回合）
+            self.go_process.found_board(board)
+            rd0, rd = self.go_process.round_end(self.cur_frame_count)  # 回合结束，返回回合信息（可能有1回合或2回合）
+
+            # 定期保存检查点
+            if self.checkpoint_path is not None \
+            and self.cur_frame_count - self._checkpoint_frame >= self.checkpoint_interval:
+                self.save_checkpoint(self.checkpoint_path)
 
             if rd0 is None and rd is None:
                 # 无变化
+                if stop is not None and stop():
+                    # 停止扫描，扫描生成器保留，下次从下一帧继续
+                    return (False, )
                 continue
             
+            # 帧缓冲区会被下一帧覆盖，返回的图像需要拷贝
+            frame = frame.copy()
+
             # 画棋子序号
             down_list = self.go_process.get_down_list()
             for x, y, no, qizi_type in down_list:
@@ -172,6 +397,145 @@ class GoVideoAnalyzer(object):
             return (True, frame, rd0, rd)
         
         return (False, )
+    
+
+    def save_checkpoint(self, path):
+        '保存分析状态检查点（当前帧数、分析参数、交点坐标、分类器、围棋进程记录）'
+        state = {
+            'video_path': self.video_path,
+            'frame_step': self.frame_step,
+            'cur_frame_count': self.cur_frame_count,
+            'black_hsv': self._black_hsv,
+            'white_hsv': self._white_hsv,
+            'qizi_color_threshold': self.qizi_color_threshold,
+            'confidence_threshold': self.confidence_threshold,
+            'resample_count': self.resample_count,
+            'coarse_factor': self.coarse_factor,
+            'cross_point_kw': self.cross_point_kw,
+            'points': self.points,
+            'classifier': self.classifier,
+            'go_process': self.go_process,
+        }
+        # 先写临时文件再替换，避免写入中断时损坏已有检查点
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self._checkpoint_frame = self.cur_frame_count
+    
+
+    def load_checkpoint(self, path, video_path=None):
+        '''从检查点恢复分析状态，重新打开视频并从检查点所在帧继续分析
+
+        video_path: 视频文件路径，None 表示使用检查点中记录的路径
+
+        返回 (是否成功, 检查点所在帧图像)
+        '''
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+
+        rets = self.load_video(video_path or state['video_path'], state['frame_step'])
+        if rets[0] == False:
+            return rets
+
+        self._black_hsv = state['black_hsv']
+        self._white_hsv = state['white_hsv']
+        self.qizi_color_threshold = state['qizi_color_threshold']
+        # 旧版本检查点没有以下参数，使用当前值
+        self.confidence_threshold = state.get('confidence_threshold', self.confidence_threshold)
+        self.resample_count = state.get('resample_count', self.resample_count)
+        self.coarse_factor = state.get('coarse_factor', self.coarse_factor)
+        self.cross_point_kw = state.get('cross_point_kw', self.cross_point_kw)
+        self._init_points(state['points'], self.go_board_im.shape)
+        self.classifier = state['classifier']
+        self.go_process = state['go_process']
+        self.cur_frame_count = self._checkpoint_frame = state['cur_frame_count']
+        self._scanner = None
+
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.cur_frame_count)
+        ret, self.go_board_im = self.cap.read()
+        return (ret, self.go_board_im)
+    
+
+    def save_timeline(self, path, snapshot_interval=32):
+        '保存时间线索引（帧数 ↔ 回合 ↔ 棋盘布局），用于快速跳转到任意回合或时间点'
+        timeline.write_timeline(path, self.go_process, snapshot_interval)
+    
+
+    def analyze_parallel(self, processes=None, segments=None):
+        '''将视频按时间分段，多进程分别识别各段棋局，再按顺序合并到同一个围棋进程记录中
+
+        需在 analyze_cross_point 之后调用，从当前帧之后开始分析到视频结束
+
+        processes: 进程数，None 表示 CPU 核数
+
+        segments: 分段数，None 表示与进程数相同
+
+        返回 回合列表 [(帧数, rd0, rd), ...]
+        '''
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if segments is None:
+            segments = processes
+
+        # 按帧数步长对齐分段起点
+        first = self.cur_frame_count + self.frame_step
+        steps = max(int(self.frame_count) - first, 0) // self.frame_step + 1
+        bounds = [first + self.frame_step * (steps * i // segments) for i in range(segments + 1)]
+        resample = (self.confidence_threshold, self.resample_count)
+        tasks = [(self.video_path, self.points, self.go_board_im.shape, self.classifier, self.frame_step, \
+                  self.coarse_factor, resample, start, end) \
+                 for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+        if processes == 1:
+            # 单进程时直接在当前进程中运行，可在其他进程池的工作进程中调用
+            results = [_classify_segment(task) for task in tasks]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.map(_classify_segment, tasks)
+
+        # 按顺序合并各段棋局，段与段之间的落子由同一个围棋进程记录判断
+        rounds = []
+        for changes in results:
+            for frame_no, board in changes:
+                self.cur_frame_count = frame_no
+                self.go_process.round_start()
+                self.go_process.found_board(board)
+                rd0, rd = self.go_process.round_end(frame_no)
+                if rd is not None:
+                    rounds.append((frame_no, rd0, rd))
+        if tasks:
+            self.cur_frame_count = bounds[-1] - self.frame_step
+        self._scanner = None
+        return rounds
+
+
+
+def _classify_segment(task):
+    '''识别视频一段中的棋局（在子进程中运行）
+
+    返回 棋局有变化的帧 [(帧数, 棋子类型二维数组), ...]，连续相同的棋局只保留第一帧
+    '''
+    video_path, points, frame_shape, classifier, frame_step, coarse_factor, resample, start, end = task
+    analyzer = GoVideoAnalyzer()
+    analyzer._init_points(points, frame_shape)
+    analyzer.classifier = classifier
+    analyzer.frame_step = frame_step
+    analyzer.coarse_factor = coarse_factor
+    analyzer.confidence_threshold, analyzer.resample_count = resample
+    analyzer.cap = cv2.VideoCapture(video_path)
+
+    changes = []
+    last_board = None
+    for frame_no, frame, board, confidence in analyzer._scan_frames(start, end, lambda: last_board):
+        if last_board is not None:
+            board = analyzer._resample_board(frame_no, board, confidence, last_board)
+        if last_board is None or (board != last_board).any():
+            board = board.copy()  # 分类结果使用复用的缓冲区
+            changes.append((frame_no, board))
+            last_board = board
+    analyzer.cap.release()
+    return changes
 
 
 
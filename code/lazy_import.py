@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+'''
+延迟导入
+
+cv2、numpy 等模块导入较慢，只用到 go_process、棋谱导出等功能的程序无需导入它们。
+lazy_import 返回一个代理对象，第一次访问其属性时才真正导入模块。
+'''
+
+import importlib
+import sys
+
+
+class _LazyModule(object):
+    '延迟导入的模块代理'
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        value = getattr(module, attr)
+        self.__dict__[attr] = value  # 缓存属性，之后的访问不再经过代理
+        return value
+
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__dict__['_name'])
+
+
+
+def lazy_import(name):
+    '延迟导入模块，模块已导入时直接返回'
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
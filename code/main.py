@@ -4,33 +4,143 @@
 主程序
 '''
 
-import os
 import sys
-import threading
-import time
-
-os.environ['QT_DRIVER'] = 'PyQt5'  # 设置当前 Qt 版本
-import qimage2ndarray
 
+import numpy as np
 from PyQt5 import QtWidgets, QtGui, QtCore
 
+from lazy_import import lazy_import
 import go_process as gp
 from go_video_analyzer import GoVideoAnalyzer
 from gui import Ui_main_window
 
+cv2 = lazy_import('cv2')
+
+
+
+class AnalyzerWorker(QtCore.QObject):
+    '视频分析工作对象，在独立的 QThread 中运行分析循环，通过信号返回结果'
+
+    # 分析出新回合：图像，停一手回合，当前回合
+    round_ready = QtCore.pyqtSignal(object, object, object)
+    # 视频分析完毕
+    finished = QtCore.pyqtSignal()
+    # 单步或自动模式暂停
+    stopped = QtCore.pyqtSignal()
+    # 棋盘分析完毕：交点坐标（失败时为 None），标记交点的图像，棋子颜色校准结果
+    board_ready = QtCore.pyqtSignal(object, object, object)
+
+
+    def __init__(self, parent=None):
+        super(AnalyzerWorker, self).__init__(parent)
+        self.analyzer = None  # 视频分析对象
+        # 以下标志由界面线程在请求分析前设置，工作线程只在分析结束时清除，
+        # 请求信号到达工作线程之前调用的 stop 不会丢失
+        self.is_auto = False  # 是否自动模式
+        self.is_stopping = False  # 是否请求停止，分析时每帧检查
+
+
+    def prepare(self, is_auto):
+        '请求分析前在界面线程中调用，设置分析模式'
+        self.is_auto = is_auto
+        self.is_stopping = False
+
+
+    def stop(self):
+        '停止分析，正在分析的帧完成后暂停，之后从停止处继续'
+        self.is_auto = False
+        self.is_stopping = True
+
+
+    @QtCore.pyqtSlot()
+    def analyze_board(self):
+        '分析棋盘交点，并根据开局画面校准棋子颜色（需多次跳转解码视频）'
+        rets = self.analyzer.analyze_cross_point()
+        if rets[0] == False:
+            self.board_ready.emit(None, None, None)
+            return
+        im = self.analyzer.mark_cross_point()
+        calibration = self.analyzer.calibrate_colors()
+        self.board_ready.emit(rets[1], im, calibration)
+
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        '分析下一回合，自动模式下连续分析直到停止或视频结束'
+        is_end = False
+        while True:
+            rets = self.analyzer.next_round(lambda: self.is_stopping)
+            if rets[0] == False:
+                # 请求停止时 next_round 也返回 False，此时视频并未结束
+                is_end = self.is_stopping == False
+                break
+            self.round_ready.emit(*rets[1:])
+            if self.is_auto == False or self.is_stopping:
+                break
+        self.is_auto = False
+        self.is_stopping = False
+        if is_end:
+            self.finished.emit()
+        else:
+            self.stopped.emit()
+
 
 
 class Window(QtWidgets.QMainWindow):
 
+    # 请求工作线程分析下一回合，分析模式由 AnalyzerWorker.prepare 预先设置
+    request_next = QtCore.pyqtSignal()
+    # 请求工作线程分析棋盘交点并校准棋子颜色
+    request_board = QtCore.pyqtSignal()
+
+    # 界面刷新视频图像的间隔（毫秒）
+    display_interval = 40
+
     def cv2_to_pixmap(self, cv_img):
-        'opncv 打开的图片转 QImage'
-        return QtGui.QPixmap.fromImage(qimage2ndarray.array2qimage(cv_img[:,:,::-1]))
+        'opncv 打开的图片按显示区域大小缩小后转 QPixmap'
+        # 先缩小到显示区域大小，再转换颜色，避免转换整幅大图
+        size = self.ui.label_video.contentsRect().size()
+        scale = min(size.width() / cv_img.shape[1], size.height() / cv_img.shape[0], 1)
+        w, h = max(int(cv_img.shape[1] * scale), 1), max(int(cv_img.shape[0] * scale), 1)
+        if (w, h) != (cv_img.shape[1], cv_img.shape[0]):
+            if self._preview_small is None or self._preview_small.shape[:2] != (h, w):
+                self._preview_small = np.empty((h, w, 3), dtype=np.uint8)
+            cv_img = cv2.resize(cv_img, (w, h), dst=self._preview_small, interpolation=cv2.INTER_AREA)
+
+        # BGR 转 RGB 到复用的缓冲区，QImage 直接引用缓冲区数据
+        if self._preview_rgb is None or self._preview_rgb.shape[:2] != (h, w):
+            self._preview_rgb = np.empty((h, w, 3), dtype=np.uint8)
+        cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB, dst=self._preview_rgb)
+        image = QtGui.QImage(self._preview_rgb.data, w, h, self._preview_rgb.strides[0], QtGui.QImage.Format_RGB888)
+        return QtGui.QPixmap.fromImage(image)
 
 
     def __init__(self, parent=None):
         super(Window, self).__init__(parent)
         self.ui = Ui_main_window()
         self.ui.setupUi(self)
+
+        self._preview_small = None  # 缩小后的预览图像缓冲区
+        self._preview_rgb = None  # RGB 预览图像缓冲区
+
+        # 常驻的分析线程，所有界面操作只在主线程进行
+        self.worker = AnalyzerWorker()
+        self.worker_thread = QtCore.QThread(self)
+        self.worker.moveToThread(self.worker_thread)
+        self.request_next.connect(self.worker.run)
+        self.request_board.connect(self.worker.analyze_board)
+        self.worker.board_ready.connect(self._on_board_ready)
+        self.worker.round_ready.connect(self._on_round_ready)
+        self.worker.finished.connect(self._on_finished)
+        self.worker.stopped.connect(self._on_stopped)
+        self.worker_thread.start()
+
+        # 按显示帧率刷新最新的视频图像，合并期间的多次更新
+        self._latest_im = None
+        self.display_timer = QtCore.QTimer(self)
+        self.display_timer.timeout.connect(self._update_video)
+        self.display_timer.start(self.display_interval)
+
         self._init_ui_and_data()
 
     
@@ -55,6 +165,8 @@ class Window(QtWidgets.QMainWindow):
         self.white_no = 0
         self.is_end = False  # 是否分析完毕
         self.analyzer = GoVideoAnalyzer()  # 视频分析对象
+        self.worker.analyzer = self.analyzer
+        self._latest_im = None
 
     
     def add_log(self, message):
@@ -94,38 +206,57 @@ class Window(QtWidgets.QMainWindow):
     
     def on_btn_cross_click(self):
         '获取交点按钮'
-        rets = self.analyzer.analyze_cross_point()
+        self.ui.btn_cross.setEnabled(False)  # 不可用，等待工作线程分析完成
+        self.request_board.emit()
+    
 
-        if rets[0] == False:
+    def _on_board_ready(self, points, im, calibration):
+        '显示棋盘交点分析和棋子颜色校准结果'
+        if points is None:
             self.add_log('分析棋盘交点失败')  # 写日志
+            self.ui.btn_cross.setEnabled(True)  # 恢复按钮
             return
         else:
             self.add_log('分析棋盘交点成功')   # 写日志
         
         # 标记交点
-        im = self.analyzer.mark_cross_point()
         self.ui.label_video.setPixmap(self.cv2_to_pixmap(im))
         
-        self.add_log('棋盘大小 {}×{}'.format(rets[1].shape[0], rets[1].shape[1]))   # 写日志
+        self.add_log('棋盘大小 {}×{}'.format(points.shape[0], points.shape[1]))   # 写日志
+
+        # 根据开局画面自动校准棋子颜色
+        self.add_log('棋子颜色校准 黑 {} 白 {} 阈值 {:.1f}'.format(calibration['black_hsv'].tolist(), \
+            calibration['white_hsv'].tolist(), calibration['threshold']))   # 写日志
 
-        self.ui.btn_cross.setEnabled(False)  # 恢复按钮
         self.ui.btn_next.setEnabled(True)  # 恢复按钮
         self.ui.btn_auto.setEnabled(True)  # 恢复按钮
     
 
+    def closeEvent(self, event):
+        '关闭窗口时结束分析线程，分析会在当前帧完成后停止，不需等待找到下一回合'
+        self.worker.stop()
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+        super(Window, self).closeEvent(event)
+
+
     def on_btn_next_click(self):
         '下一回合按钮'
-        t = threading.Thread(target=self._next_round)
-        t.start()
+        self.ui.btn_next.setEnabled(False)  # 不可用
+        self.ui.btn_auto.setEnabled(False)  # 不可用
+        self.worker.prepare(False)
+        self.request_next.emit()
     
 
     def on_btn_auto_click(self):
         '自动模式按钮'
         if self.ui.btn_auto.isChecked():
-            t = threading.Thread(target=self._auto_next)
-            t.start()
+            self.ui.btn_next.setEnabled(False)  # 不可用
+            self.worker.prepare(True)
+            self.request_next.emit()
         else:
-            self.ui.btn_auto.setEnabled(False)
+            self.worker.stop()
+            self.ui.btn_auto.setEnabled(False)  # 等待当前帧分析完成
     
 
     def on_btn_sgf_click(self):
@@ -152,35 +283,46 @@ class Window(QtWidgets.QMainWindow):
 
         self.add_log('视频尺寸 {}×{}, 视频总帧数 {}'.format(im.shape[1], im.shape[0], frame_count))   # 写日志
 
-        self.ui.label_video.setMinimumSize(im.shape[1], im.shape[0])
         self.ui.label_video.setPixmap(self.cv2_to_pixmap(im))
 
         self.ui.btn_cross.setEnabled(True)  # 恢复按钮
     
 
-    def _next_round(self, is_auto=False):
-        '分析下一回合'
-        self.ui.label_info.setVisible(False)  # 不可见
-        self.ui.btn_next.setEnabled(False)  # 不可用
-        rets = self.analyzer.next_round()
+    def _update_video(self):
+        '显示最新的视频图像'
+        if self._latest_im is not None:
+            self.ui.label_video.setPixmap(self.cv2_to_pixmap(self._latest_im))
+            self._latest_im = None
+    
 
-        if rets[0] == False:
-            self.is_end = True
-            self.add_log('分析完成！')  # 写日志
+    def _on_finished(self):
+        '视频分析完毕'
+        self.is_end = True
+        self.add_log('分析完成！')  # 写日志
 
-            # 输出提示信息
-            self.ui.btn_cross.setEnabled(False)  # 恢复按钮
-            self.ui.btn_next.setEnabled(False)  # 恢复按钮
-            self.ui.btn_auto.setEnabled(False)  # 恢复按钮
-            self.ui.btn_sgf.setEnabled(True)  # 恢复按钮
+        # 输出提示信息
+        self.ui.btn_cross.setEnabled(False)  # 恢复按钮
+        self.ui.btn_next.setEnabled(False)  # 恢复按钮
+        self.ui.btn_auto.setChecked(False)
+        self.ui.btn_auto.setEnabled(False)  # 恢复按钮
+        self.ui.btn_sgf.setEnabled(True)  # 恢复按钮
 
-            self.ui.label_info.setText(self.get_color_text('棋局结束！'))
-            self.ui.label_info.setVisible(True)  # 可见
+        self.ui.label_info.setText(self.get_color_text('棋局结束！'))
+        self.ui.label_info.setVisible(True)  # 可见
+    
 
-            return
-        
-        im, rd0, rd = rets[1:]  # 获取返回的 image 和棋局信息
-        self.ui.label_video.setPixmap(self.cv2_to_pixmap(im))
+    def _on_stopped(self):
+        '单步或自动模式暂停'
+        if self.is_end == False:
+            self.ui.btn_auto.setChecked(False)
+            self.ui.btn_auto.setEnabled(True)
+            self.ui.btn_next.setEnabled(True)
+    
+
+    def _on_round_ready(self, im, rd0, rd):
+        '显示分析出的回合'
+        self._latest_im = im  # 由定时器刷新图像
+        self.ui.label_info.setVisible(False)  # 不可见
 
         if rd0 != None:
             self.add_log(str(rd0))  # 写日志
@@ -211,24 +353,7 @@ class Window(QtWidgets.QMainWindow):
             temp = []
             for x, y, no in rd.take:
                 temp.append('{}({},{})'.format(no, x, y))
-                self.ui.edit_take_where.setText(', '.join(temp))  # 提子坐标
-        
-        if is_auto == False:
-            self.ui.btn_next.setEnabled(True)  # 可用
-    
-
-    def _auto_next(self):
-        '自动下一回合'
-        while self.ui.btn_auto.isChecked() and self.is_end == False:
-            t = threading.Thread(target=self._next_round, args=(True,))
-            t.start()
-            t.join()
-        
-        if self.is_end == False:
-            self.ui.btn_auto.setEnabled(True)
-            self.ui.btn_next.setEnabled(True)
-        else:
-            self.ui.btn_auto.setChecked(False)
+            self.ui.edit_take_where.setText(', '.join(temp))  # 提子坐标
 
 
 
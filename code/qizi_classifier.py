@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+'''
+棋子颜色分类器
+
+分类器以所有交叉点采样颜色组成的数组为输入，一次性返回整个棋盘的棋子布局
+'''
+
+import numpy as np
+
+import go_process as gp
+
+
+class QiziClassifier(object):
+    '棋子分类器基类'
+
+    def calibrate(self, hsv_values):
+        '''根据视频首帧交叉点颜色校准分类器，每个视频只调用一次
+
+        hsv_values: numpy 三维数组，前两维为交点序号，最后一维为 h s v 颜色
+        '''
+        pass
+
+
+    def classify(self, hsv_values):
+        '''分类所有交叉点
+
+        hsv_values: numpy 三维数组，前两维为交点序号，最后一维为 h s v 颜色
+
+        返回 numpy 二维数组，元素为 QI_BLANK、QI_BLACK 或 QI_WHITE。
+        返回值可以是分类器复用的缓冲区，下次分类时会被覆盖，调用者需要保留时应拷贝
+        '''
+        raise NotImplementedError
+
+
+    def classify_confidence(self, hsv_values):
+        '''分类所有交叉点，并给出每个交叉点的置信度
+
+        hsv_values: numpy 三维数组，前两维为交点序号，最后一维为 h s v 颜色
+
+        返回 (棋子类型二维数组, 置信度二维数组)，置信度在 0 到 1 之间，越小表示颜色越接近分类边界。
+        与 classify 相同，返回值可以是复用的缓冲区
+        '''
+        board = self.classify(hsv_values)
+        return board, np.ones(board.shape)
+
+
+
+class LutClassifier(QiziClassifier):
+    '''三维颜色查找表分类器
+
+    查找表只由黑白棋子参考颜色和阈值决定，不使用 calibrate 校准（参考颜色的校准见 color_calibration）。
+    每个量化区间按区间中心颜色分类，与逐个颜色直接比较阈值相比，分类边界最多相差半个区间
+    （bits=6 时为 2），如默认参考颜色下 v=40 不再判为黑子
+    '''
+
+    def __init__(self, black_hsv, white_hsv, threshold, bits=6):
+        '''
+        black_hsv: 黑色棋子 hsv 颜色
+
+        white_hsv: 白色棋子 hsv 颜色
+
+        threshold: 棋子 hsv 颜色允许阈值
+
+        bits: 每个颜色通道量化位数，查找表大小为 (2^bits)^3
+        '''
+        self.black_hsv = np.asarray(black_hsv, dtype=float)
+        self.white_hsv = np.asarray(white_hsv, dtype=float)
+        self.threshold = threshold
+        self.shift = 8 - bits  # 颜色值右移位数
+        self.table, self.confidence_table = self._build_table(bits)
+        self._init_buffers(())
+
+
+    def _init_buffers(self, shape):
+        '按交点数组形状分配分类用的缓冲区，形状不变时每帧复用'
+        self._clipped = np.empty(shape + (3,))  # 限制范围后的颜色值
+        self._index = np.empty(shape + (3,), dtype=np.intp)  # 各通道量化值
+        self._flat_index = np.empty(shape, dtype=np.intp)  # 展平查找表中的序号
+        self._board = np.empty(shape, dtype=np.uint8)
+        self._confidence = np.empty(shape, dtype=np.float32)
+
+
+    def _build_table(self, bits):
+        '按各量化区间中心颜色预先计算分类结果和置信度'
+        size = 1 << bits
+        step = 1 << self.shift
+        centers = np.arange(size) * step + (step - 1) / 2
+        h, s, v = np.meshgrid(centers, centers, centers, indexing='ij')
+        hsv = np.stack((h, s, v), axis=-1)
+
+        # 黑色棋子只比较 v 值，白色棋子比较 h s v 三个值
+        black_distance = np.abs(v - self.black_hsv[2])
+        white_distance = np.abs(hsv - self.white_hsv).max(axis=-1)
+        is_black = black_distance <= self.threshold
+        is_white = white_distance <= self.threshold
+
+        table = np.full((size, size, size), gp.QI_BLANK, dtype=np.uint8)
+        table[is_white] = gp.QI_WHITE
+        table[is_black] = gp.QI_BLACK  # 黑色优先
+
+        # 置信度为颜色到阈值边界的距离（相对于阈值），棋子在阈值内侧，空白在阈值外侧
+        margin = np.minimum(black_distance, white_distance) - self.threshold
+        margin[is_white] = self.threshold - white_distance[is_white]
+        margin[is_black] = self.threshold - black_distance[is_black]
+        confidence = np.clip(margin / max(self.threshold, 1), 0, 1).astype(np.float32)
+        return table, confidence
+
+
+    def __getstate__(self):
+        '序列化时不保存查找表和缓冲区，使检查点文件保持很小'
+        state = self.__dict__.copy()
+        for name in ('table', 'confidence_table', '_clipped', '_index', '_flat_index', '_board', '_confidence'):
+            state.pop(name, None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table, self.confidence_table = self._build_table(8 - self.shift)
+        self._init_buffers(())
+
+
+    def _table_index(self, hsv_values):
+        '颜色值量化为展平查找表中的序号，写入复用的缓冲区'
+        if self._flat_index.shape != hsv_values.shape[:-1]:
+            self._init_buffers(hsv_values.shape[:-1])
+        bits = 8 - self.shift
+        index = self._index
+        np.clip(hsv_values, 0, 255, out=self._clipped)
+        np.copyto(index, self._clipped, casting='unsafe')
+        np.right_shift(index, self.shift, out=index)
+        # 序号 = h << 2*bits | s << bits | v
+        np.left_shift(index[..., 0], 2 * bits, out=self._flat_index)
+        np.left_shift(index[..., 1], bits, out=index[..., 1])
+        np.bitwise_or(self._flat_index, index[..., 1], out=self._flat_index)
+        np.bitwise_or(self._flat_index, index[..., 2], out=self._flat_index)
+        return self._flat_index
+
+
+    def classify(self, hsv_values):
+        return np.take(self.table.reshape(-1), self._table_index(hsv_values), out=self._board)
+
+
+    def classify_confidence(self, hsv_values):
+        index = self._table_index(hsv_values)
+        np.take(self.table.reshape(-1), index, out=self._board)
+        np.take(self.confidence_table.reshape(-1), index, out=self._confidence)
+        return self._board, self._confidence
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+'''
+回归与准确率测试
+
+在一组视频上运行分析程序，将得到的着手序列与参考 sgf 棋谱比较，并列输出着手级别的准确率、召回率和耗时。
+视频的参考棋谱为同名的 .sgf 文件，如 samples/2.mp4 对应 samples/2.sgf。
+还可以生成合成视频（随机对局，中间有手遮挡棋盘），参考棋谱随视频一起生成。
+测试视频还会被缩放到 16:9 等非正方形的大画面后一并测试，检查棋盘检测与视频分辨率、宽高比无关。
+
+准确率 = 匹配的着手数 / 分析得到的着手数，召回率 = 匹配的着手数 / 参考棋谱着手数，
+匹配的着手为两个着手序列的最长公共子序列。
+
+用法: python regression.py [-s 合成视频数] [-m 分析方式,...] [-r 宽x高,...] [--save 结果文件] [--compare 结果文件] [视频 ...]
+不指定视频时使用 samples/2.mp4。
+指定 --compare 时与之前保存的结果比较，任一结果的准确率或召回率下降时返回非零退出码；
+否则任一结果准确率或召回率低于 1 时返回非零退出码。
+'''
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+
+'默认测试视频'
+DEFAULT_VIDEOS = [os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples', '2.mp4'))]
+'分析方式：serial 逐回合调用 next_round，parallel 调用 analyze_parallel'
+MODES = ('serial', 'parallel')
+'测试视频缩放后的画面大小 (宽, 高)'
+RESIZES = ((1280, 720), (1920, 1080))
+
+'合成视频颜色（BGR）'
+BOARD_COLOR = (101, 145, 190)
+LINE_COLOR = (40, 40, 40)
+BLACK_COLOR = (20, 20, 20)
+WHITE_COLOR = (208, 222, 230)
+HAND_COLOR = (120, 160, 215)
+
+
+def sgf_path(video_path):
+    '视频对应的参考棋谱路径'
+    return os.path.splitext(video_path)[0] + '.sgf'
+
+
+def parse_sgf_moves(text):
+    '从 sgf 棋谱文本中解析着手序列，返回 [(下棋方 B/W, 坐标), ...]，停一手坐标为空'
+    return re.findall(r';\s*([BW])\[([a-z]{2}|)\]', text)
+
+
+def match_moves(produced, reference):
+    '''比较两个着手序列
+
+    返回 (匹配的着手数, 准确率, 召回率)
+    '''
+    # 最长公共子序列，逐行动态规划
+    row = [0] * (len(reference) + 1)
+    for move in produced:
+        prev = 0
+        for j, ref_move in enumerate(reference):
+            prev, row[j + 1] = row[j + 1], prev + 1 if move == ref_move else max(row[j + 1], row[j])
+    matched = row[-1]
+    precision = matched / len(produced) if produced else float(not reference)
+    recall = matched / len(reference) if reference else 1.0
+    return matched, precision, recall
+
+
+def _render_board(size, stones, frame_size, margin):
+    '画合成棋盘图像，stones 为 {(x, y): 颜色}'
+    im = np.empty((frame_size, frame_size, 3), dtype=np.uint8)
+    im[:] = BOARD_COLOR
+    spacing = (frame_size - 2 * margin) / (size - 1)
+    pos = [int(round(margin + i * spacing)) for i in range(size)]
+    for p in pos:
+        cv2.line(im, (p, pos[0]), (p, pos[-1]), LINE_COLOR, 2)
+        cv2.line(im, (pos[0], p), (pos[-1], p), LINE_COLOR, 2)
+    radius = int(spacing * 0.45)
+    for (x, y), color in stones.items():
+        cv2.circle(im, (pos[x], pos[y]), radius, color, -1, cv2.LINE_AA)
+    return im
+
+
+def make_synthetic_video(path, size=9, moves=40, fps=15, hold_seconds=1.0, occlusion_every=5, \
+                         frame_size=720, seed=0):
+    '''生成合成对局视频和参考棋谱
+
+    path: 视频文件路径，参考棋谱保存为同名 .sgf 文件
+
+    size: 棋盘大小
+
+    moves: 着手数，随机落在空交叉点上，不提子
+
+    fps: 视频帧率
+
+    hold_seconds: 每手之后棋盘保持不变的时间
+
+    occlusion_every: 每隔几手在落子前用手遮挡一部分棋盘，0 表示不遮挡
+
+    返回 参考棋谱文本
+    '''
+    rng = np.random.RandomState(seed)
+    co = 'abcdefghijklmnopqrstuvwxyz'
+    margin = frame_size // 10
+    points = [(i % size, i // size) for i in rng.permutation(size * size)[:moves]]
+    hold = max(int(round(fps * hold_seconds)), 1)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_size, frame_size))
+    if writer.isOpened() == False:
+        raise IOError('无法写入视频: {}'.format(path))
+
+    # 加入少量噪声，模拟摄像头画面，噪声图像预先生成后循环使用
+    noises = rng.randint(-3, 4, (8, frame_size, frame_size, 3))
+    noises = [(np.maximum(n, 0).astype(np.uint8), np.maximum(-n, 0).astype(np.uint8)) for n in noises]
+    frame_no = [0]
+
+    def write(im, count):
+        for _ in range(count):
+            add, sub = noises[frame_no[0] % len(noises)]
+            writer.write(cv2.subtract(cv2.add(im, add), sub))  # 饱和运算
+            frame_no[0] += 1
+
+    stones = {}
+    im = _render_board(size, stones, frame_size, margin)
+    write(im, hold)
+    text = ''
+    for i, (x, y) in enumerate(points):
+        if occlusion_every > 0 and i > 0 and i % occlusion_every == 0:
+            # 手伸入画面，遮挡部分棋盘
+            hand = im.copy()
+            center = (int(rng.randint(margin, frame_size - margin)), frame_size - margin // 2)
+            cv2.ellipse(hand, center, (frame_size // 8, frame_size // 3), 0, 0, 360, HAND_COLOR, -1)
+            write(hand, hold // 2)
+        black = i % 2 == 0
+        stones[(x, y)] = BLACK_COLOR if black else WHITE_COLOR
+        im = _render_board(size, stones, frame_size, margin)
+        write(im, hold)
+        text += '{}[{}{}]'.format(';B' if black else ';W', co[x], co[y])
+    writer.release()
+
+    text = '(;SZ[{}]\n{})'.format(size, text)
+    with open(sgf_path(path), 'w') as f:
+        f.write(text + '\n')
+    return text
+
+
+def make_resized_video(src_path, path, width, height):
+    '''将视频缩放到指定画面大小，保持宽高比，画面在一个方向上填满，另一方向两侧延伸边缘像素补齐
+
+    参考棋谱复制为同名 .sgf 文件
+    '''
+    cap = cv2.VideoCapture(src_path)
+    if cap.isOpened() == False:
+        raise IOError('读取视频失败: {}'.format(src_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if writer.isOpened() == False:
+        cap.release()
+        raise IOError('无法写入视频: {}'.format(path))
+    try:
+        while True:
+            ret, im = cap.read()
+            if ret == False:
+                break
+            scale = min(width / im.shape[1], height / im.shape[0])
+            im = cv2.resize(im, None, fx=scale, fy=scale, \
+                            interpolation=cv2.INTER_LINEAR if scale > 1 else cv2.INTER_AREA)
+            top, left = (height - im.shape[0]) // 2, (width - im.shape[1]) // 2
+            # 用边缘像素补齐，不引入额外的直线
+            writer.write(cv2.copyMakeBorder(im, top, height - im.shape[0] - top, left, width - im.shape[1] - left, \
+                                            cv2.BORDER_REPLICATE))
+    finally:
+        cap.release()
+        writer.release()
+    shutil.copyfile(sgf_path(src_path), sgf_path(path))
+
+
+def analyze(video_path, mode='serial'):
+    '''按指定方式分析视频
+
+    返回 (sgf 棋谱文本, 耗时秒数)，分析失败时棋谱为 None
+    '''
+    from go_video_analyzer import GoVideoAnalyzer
+
+    start = time.perf_counter()
+    analyzer = GoVideoAnalyzer()
+    if analyzer.load_video(video_path)[0] == False or analyzer.analyze_cross_point()[0] == False:
+        return None, time.perf_counter() - start
+    if mode == 'serial':
+        while analyzer.next_round()[0]:
+            pass
+    elif mode == 'parallel':
+        analyzer.analyze_parallel()
+    else:
+        raise ValueError('未知分析方式: {}'.format(mode))
+    return analyzer.go_process.get_sgf_text(), time.perf_counter() - start
+
+
+def run(video_paths, modes=MODES):
+    '''分析所有视频并与参考棋谱比较
+
+    返回 结果列表 [{'video', 'mode', 'reference', 'produced', 'matched', 'precision', 'recall', 'seconds'}, ...]
+    '''
+    results = []
+    for path in video_paths:
+        with open(sgf_path(path)) as f:
+            reference = parse_sgf_moves(f.read())
+        for mode in modes:
+            text, seconds = analyze(path, mode)
+            produced = [] if text is None else parse_sgf_moves(text)
+            matched, precision, recall = match_moves(produced, reference)
+            results.append({'video': path, 'mode': mode, 'reference': len(reference), 'produced': len(produced), \
+                            'matched': matched, 'precision': precision, 'recall': recall, 'seconds': seconds})
+    return results
+
+
+def print_results(results):
+    '按视频并列输出各分析方式的结果'
+    modes = []
+    for result in results:
+        if result['mode'] not in modes:
+            modes.append(result['mode'])
+    header = '{:<24} {:>5}'.format('视频', '参考') + ''.join( \
+        ' | {:<8} {:>5} {:>6} {:>6} {:>7}'.format(mode, '着手', '准确率', '召回率', '秒') for mode in modes)
+    print(header)
+    by_video = {}
+    for result in results:
+        by_video.setdefault(result['video'], {})[result['mode']] = result
+    for path, row in by_video.items():
+        line = '{:<24} {:>5}'.format(os.path.basename(path)[-24:], next(iter(row.values()))['reference'])
+        for mode in modes:
+            r = row.get(mode)
+            line += ' | {:<8} {:>5} {:>6.3f} {:>6.3f} {:>7.2f}'.format( \
+                '', r['produced'], r['precision'], r['recall'], r['seconds']) if r else ' | ' + ' ' * 36
+        print(line)
+
+
+def compare_results(results, baseline):
+    '''与之前保存的结果比较
+
+    返回 准确率或召回率下降的结果 [(结果, 之前的结果), ...]
+    '''
+    previous = {(os.path.basename(r['video']), r['mode']): r for r in baseline}
+    worse = []
+    for result in results:
+        old = previous.get((os.path.basename(result['video']), result['mode']))
+        if old is not None and (result['precision'] < old['precision'] or result['recall'] < old['recall']):
+            worse.append((result, old))
+    return worse
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='分析结果回归测试')
+    parser.add_argument('videos', nargs='*', help='测试视频，参考棋谱为同名 .sgf 文件')
+    parser.add_argument('-s', '--synthetic', type=int, default=0, help='生成的合成视频数')
+    parser.add_argument('-m', '--modes', default=','.join(MODES), help='分析方式，逗号分隔')
+    parser.add_argument('-r', '--resize', default=','.join('{}x{}'.format(*size) for size in RESIZES), \
+                        help='测试视频另外缩放到的画面大小，如 1280x720，逗号分隔，为空时不缩放')
+    parser.add_argument('--save', help='保存结果的 json 文件')
+    parser.add_argument('--compare', help='与之前保存的结果比较')
+    args = parser.parse_args()
+
+    videos = list(args.videos or DEFAULT_VIDEOS)
+    resizes = [tuple(int(n) for n in size.split('x')) for size in args.resize.split(',') if size]
+    temp_dir = tempfile.mkdtemp() if args.synthetic > 0 or resizes else None
+    try:
+        for path in list(videos):
+            for width, height in resizes:
+                name = '{}_{}x{}.mp4'.format(os.path.splitext(os.path.basename(path))[0], width, height)
+                make_resized_video(path, os.path.join(temp_dir, name), width, height)
+                videos.append(os.path.join(temp_dir, name))
+        for i in range(args.synthetic):
+            path = os.path.join(temp_dir, 'synthetic_{}.mp4'.format(i))
+            make_synthetic_video(path, size=(9, 13, 19)[i % 3], seed=i)
+            videos.append(path)
+        results = run(videos, args.modes.split(','))
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            failed = compare_results(results, json.load(f))
+        for result, old in failed:
+            print('结果变差: {} {} 准确率 {:.3f} -> {:.3f} 召回率 {:.3f} -> {:.3f}'.format( \
+                os.path.basename(result['video']), result['mode'], old['precision'], result['precision'], \
+                old['recall'], result['recall']))
+    else:
+        failed = [r for r in results if r['precision'] < 1 or r['recall'] < 1]
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+'''
+棋局时间线索引
+
+记录 视频帧数 ↔ 回合 ↔ 棋盘布局 的对应关系，用于快速跳转到任意回合或时间点。
+棋盘布局以“定期完整快照 + 每回合变化”的方式存储，文件通过 numpy.memmap 读取，打开大文件无需全部载入。
+
+文件结构（小端）：文件头 | 回合表 | 变化表 | 快照表
+'''
+
+import numpy as np
+
+import go_process as gp
+
+
+'文件标识'
+MAGIC = b'GOTL'
+'文件格式版本'
+VERSION = 1
+
+'文件头'
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u2'), ('height', '<u2'), ('width', '<u2'),
+                         ('snapshot_interval', '<u2'), ('round_count', '<u4'), ('delta_count', '<u4'),
+                         ('snapshot_count', '<u4')])
+'回合表：帧数，下棋方，动作，落子坐标（停一手为 -1），本回合变化在变化表中的起点和数量'
+ROUND_DTYPE = np.dtype([('frame', '<i8'), ('who', 'u1'), ('action', 'u1'), ('x', 'i1'), ('y', 'i1'),
+                        ('delta_start', '<u4'), ('delta_count', '<u2')])
+'变化表：坐标，变化后的棋子类型'
+DELTA_DTYPE = np.dtype([('x', 'u1'), ('y', 'u1'), ('value', 'u1')])
+
+
+def write_timeline(path, go_process, snapshot_interval=32):
+    '''将围棋进程记录写为时间线索引文件
+
+    go_process: GoProcess 对象
+
+    snapshot_interval: 每隔多少回合保存一次完整棋盘快照
+    '''
+    process = go_process.process
+    height, width = go_process.shape
+
+    rounds = np.zeros(len(process), dtype=ROUND_DTYPE)
+    deltas = []
+    snapshots = []
+    board = np.zeros((height, width), dtype=np.uint8)
+
+    for i, rd in enumerate(process):
+        if i % snapshot_interval == 0:
+            snapshots.append(board.copy())
+
+        frame_no = getattr(rd, 'frame_no', None)
+        rounds[i] = (-1 if frame_no is None else frame_no, rd.who, rd.action, -1, -1, len(deltas), 0)
+        if rd.action != gp.ACT_GIVE_UP:
+            x, y = rd.down[:2]
+            rounds[i]['x'], rounds[i]['y'] = x, y
+            board[y, x] = rd.who
+            deltas.append((x, y, rd.who))
+            for x, y, no in rd.take:
+                board[y, x] = gp.QI_BLANK
+                deltas.append((x, y, gp.QI_BLANK))
+        rounds[i]['delta_count'] = len(deltas) - rounds[i]['delta_start']
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, VERSION, height, width, snapshot_interval, len(rounds), len(deltas), len(snapshots))
+
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(rounds.tobytes())
+        f.write(np.array(deltas, dtype=DELTA_DTYPE).tobytes())
+        f.write(np.array(snapshots, dtype=np.uint8).tobytes())
+
+
+
+class Timeline(object):
+    '时间线索引读取类'
+
+    def __init__(self, path):
+        '打开时间线索引文件（内存映射，不读取全部数据）'
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError('不是有效的时间线索引文件: {}'.format(path))
+
+        self.shape = (int(header['height']), int(header['width']))
+        self.snapshot_interval = int(header['snapshot_interval'])
+
+        offset = HEADER_DTYPE.itemsize
+        self.rounds = self._memmap(path, ROUND_DTYPE, offset, int(header['round_count']))
+        offset += self.rounds.nbytes
+        self.deltas = self._memmap(path, DELTA_DTYPE, offset, int(header['delta_count']))
+        offset += self.deltas.nbytes
+        self.snapshots = self._memmap(path, np.uint8, offset, int(header['snapshot_count']) * self.shape[0] * self.shape[1])
+        self.snapshots = self.snapshots.reshape((-1,) + self.shape)
+        '是否所有回合都记录了帧数'
+        self.has_frames = not (self.rounds['frame'] < 0).any()
+
+
+    @staticmethod
+    def _memmap(path, dtype, offset, count):
+        '内存映射文件中的一段数组，空数组不能映射'
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+    def __len__(self):
+        '回合总数'
+        return len(self.rounds)
+
+
+    def get_board(self, round_no=None):
+        '''获得指定回合之后的棋盘布局
+
+        round_no: 指定的回合，0 表示开局，None 表示到最后一回合
+
+        返回 numpy 二维数组，元素为 QI_BLANK、QI_BLACK 或 QI_WHITE
+        '''
+        if round_no is None:
+            round_no = len(self.rounds)
+        if round_no < 0 or round_no > len(self.rounds):
+            raise IndexError('回合超出范围: {}'.format(round_no))
+
+        # 从最近的快照开始，应用之后各回合的变化
+        k = min(round_no // self.snapshot_interval, len(self.snapshots) - 1)
+        if k < 0:
+            return np.zeros(self.shape, dtype=np.uint8)
+        board = np.array(self.snapshots[k])
+        start = k * self.snapshot_interval
+        if round_no > start:
+            rounds = self.rounds[start:round_no]
+            d_start = rounds[0]['delta_start']
+            d_end = rounds[-1]['delta_start'] + rounds[-1]['delta_count']
+            for x, y, value in self.deltas[d_start:d_end]:
+                board[y, x] = value
+        return board
+
+
+    def get_round_no(self, frame_no):
+        '''获得指定视频帧时已完成的回合数
+
+        需要所有回合都记录了帧数（帧数按回合递增），有回合没有帧数（-1）时抛出 ValueError
+        '''
+        if not self.has_frames:
+            # 没有帧数的回合记录为 -1，帧数列无序，不能二分查找
+            raise ValueError('时间线中有回合没有记录帧数，不能按帧数查找')
+        return int(np.searchsorted(self.rounds['frame'], frame_no, side='right'))
+
+
+    def get_frame_no(self, round_no):
+        '获得指定回合所在的视频帧数，round_no 从 1 开始，没有记录帧数时为 -1'
+        if round_no < 1 or round_no > len(self.rounds):
+            raise IndexError('回合超出范围: {}'.format(round_no))
+        return int(self.rounds[round_no - 1]['frame'])
+
+
+    def get_board_at_frame(self, frame_no):
+        '获得指定视频帧时的棋盘布局'
+        return self.get_board(self.get_round_no(frame_no))